@@ -0,0 +1,64 @@
+import copy
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+
+UserModel = get_user_model()
+
+# every page shows the user's avatar, so the user is cached together with the profile;
+# the changes made by UPDATE queries (which don't send signals) show up within this many seconds
+USER_CACHE_TIMEOUT = 60
+
+
+def user_cache_key(user_id):
+    return f'core:user:{user_id}'
+
+
+def invalidate_user(user_id):
+    # deleted once more after the commit, so a concurrent request doesn't cache uncommitted data
+    key = user_cache_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def cached_user(user):
+    """
+    The user as it's kept in the shared cache: a copy without the password hash (the field is deferred,
+    so it's loaded from the database if it's ever used) and the session hash made of it
+    """
+    session_auth_hash = user.get_session_auth_hash()
+    user = copy.copy(user)
+    del user.password
+    return user, session_auth_hash
+
+
+def restore_user(user, session_auth_hash):
+    """Verify the sessions with the cached hash until the password hash is loaded or changed"""
+    def get_session_auth_hash():
+        if 'password' not in user.__dict__:
+            return session_auth_hash
+        return UserModel.get_session_auth_hash(user)
+
+    user.get_session_auth_hash = get_session_auth_hash
+    return user
+
+
+class ProfileModelBackend(ModelBackend):
+    """
+    Loads the user of the session with the profile joined and keeps them in the cache,
+    so an authenticated request doesn't query neither of them
+    """
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        cached = cache.get(key)
+        if cached is None:
+            user = UserModel._default_manager.select_related('profile').filter(pk=user_id).first()
+            if user is None:
+                return None
+            cache.set(key, cached_user(user), USER_CACHE_TIMEOUT)
+        else:
+            user = restore_user(*cached)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from .models import UnreadCounter
+
+
+def unread_counters(request):
+    """
+    The user's UnreadCounter (a single primary key lookup, made only if a template uses it)
+    """
+    if not request.user.is_authenticated:
+        return {}
+
+    return {'unread_counter': SimpleLazyObject(
+        lambda: UnreadCounter.objects.filter(user_id=request.user.pk).first() or UnreadCounter())}
@@ -0,0 +1,54 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F
+
+from feed.models import FeedEntry
+from messaging.models import MailboxEntry
+from .models import UnreadCounter
+
+
+def change_unread_counter(field, user_ids, amount):
+    """Add `amount` to the counter `field` of the users with a single UPDATE"""
+    if user_ids and amount:
+        UnreadCounter.objects.filter(user_id__in=user_ids).update(**{field: F(field) + amount})
+
+
+def unread_messages():
+    """Mailbox entries of the received messages which are neither read nor deleted"""
+    return MailboxEntry.objects.filter(folder=MailboxEntry.INBOX, is_read=False)
+
+
+def reconcile_unread_counters(batch_size=1000):
+    """
+    Walk over the users in primary key order and recalculate their counters (creating the missing ones).
+    Each chunk of counters is locked while it's reconciled, so concurrent changes made by the signals
+    are applied on top of the recalculated values instead of being lost. Return the amount of fixed counters.
+    """
+    last_pk = 0
+    fixed = 0
+
+    while True:
+        with transaction.atomic():
+            user_ids = list(User.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not user_ids:
+                return fixed
+
+            UnreadCounter.objects.bulk_create([UnreadCounter(user_id=pk) for pk in user_ids], ignore_conflicts=True)
+            counters = list(UnreadCounter.objects.select_for_update().filter(user_id__in=user_ids))
+
+            # a single aggregate query per chunk and counter
+            feed_posts = dict(FeedEntry.objects.filter(user_id__in=user_ids).order_by().values('user')
+                              .annotate(amount=Count('pk')).values_list('user', 'amount'))
+            messages = dict(unread_messages().filter(user_id__in=user_ids).order_by().values('user')
+                            .annotate(amount=Count('pk')).values_list('user', 'amount'))
+
+            changed = []
+            for counter in counters:
+                actual = (feed_posts.get(counter.user_id, 0), messages.get(counter.user_id, 0))
+                if (counter.feed_posts, counter.messages) != actual:
+                    counter.feed_posts, counter.messages = actual
+                    changed.append(counter)
+            UnreadCounter.objects.bulk_update(changed, [UnreadCounter.FEED_POSTS, UnreadCounter.MESSAGES])
+
+        fixed += len(changed)
+        last_pk = user_ids[-1]
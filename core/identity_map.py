@@ -0,0 +1,60 @@
+"""
+Request-scoped identity map: a row looked up by primary key is loaded once per request, the next lookups
+of the same row return the same instance. The map is started and cleared by IdentityMapMiddleware,
+outside of requests (tasks, commands) every lookup queries the database.
+"""
+from asgiref.local import Local
+from django.core.exceptions import ValidationError
+from django.http import Http404
+
+_local = Local()
+
+
+class IdentityMap:
+    def __init__(self):
+        self.objects = {}
+        # lookups served from the map and from the database, for debugging
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model, pk):
+        try:
+            key = (model._meta.label, model._meta.pk.to_python(pk))
+        except ValidationError:
+            return None
+
+        if key in self.objects:
+            self.hits += 1
+            return self.objects[key]
+
+        self.misses += 1
+        obj = model._default_manager.filter(pk=key[1]).first()
+        if obj is not None:
+            self.objects[key] = obj
+        return obj
+
+
+def start():
+    _local.identity_map = IdentityMap()
+    return _local.identity_map
+
+
+def clear():
+    _local.identity_map = None
+
+
+def get_identity_map():
+    """The map of the current request, or a new one which is thrown away after the lookup"""
+    return getattr(_local, 'identity_map', None) or IdentityMap()
+
+
+def get_object(model, pk):
+    """Return the `model` instance with the primary key `pk` or None"""
+    return get_identity_map().get(model, pk)
+
+
+def get_object_or_404(model, pk):
+    obj = get_object(model, pk)
+    if obj is None:
+        raise Http404(f"No {model._meta.object_name} matches the given query.")
+    return obj
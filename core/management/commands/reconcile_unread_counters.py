@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import reconcile_unread_counters
+
+
+class Command(BaseCommand):
+    help = "Recalculate the unread feed posts and messages counters of users"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Amount of users reconciled per transaction")
+
+    def handle(self, *args, **options):
+        fixed = reconcile_unread_counters(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Fixed unread counters of {fixed} users"))
@@ -0,0 +1,18 @@
+import logging
+
+from . import identity_map
+
+
+class IdentityMapMiddleware:
+    """Gives every request its own identity map (see identity_map.py) and clears it when the response is ready"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        current_map = identity_map.start()
+        try:
+            return self.get_response(request)
+        finally:
+            identity_map.clear()
+            logging.debug("Identity map of %s: %s hits, %s misses", request.path, current_map.hits, current_map.misses)
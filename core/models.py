@@ -1,3 +1,18 @@
 from django.db import models
+from django.contrib.auth.models import User
 
-# Create your models here.
+
+class UnreadCounter(models.Model):
+    """
+    Amounts of the user's unread feed posts and messages shown in the navigation bar.
+    They are changed by the signals of the feed and messaging apps and corrected periodically, see counters.py
+    """
+    FEED_POSTS = 'feed_posts'
+    MESSAGES = 'messages'
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="unread_counter")
+    feed_posts = models.IntegerField(default=0)
+    messages = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user}: {self.feed_posts} feed posts, {self.messages} messages'
@@ -0,0 +1,153 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+def encode_cursor(values):
+    """Encode a list of JSON-serializable values into an url-safe cursor string"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode the cursor made by encode_cursor(), raise Http404 if it is malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        raise Http404("Invalid page cursor")
+
+    if not isinstance(values, list):
+        raise Http404("Invalid page cursor")
+    return values
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_querystring = None
+        self.previous_querystring = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def set_querystrings(self, query_dict):
+        """Build the query strings of the neighbouring pages, preserving the rest of GET parameters"""
+        for cursor, direction, attr in ((self.next_cursor, 'after', 'next_querystring'),
+                                        (self.previous_cursor, 'before', 'previous_querystring')):
+            if cursor is not None:
+                query = query_dict.copy()
+                query.pop('after', None)
+                query.pop('before', None)
+                query[direction] = cursor
+                setattr(self, attr, query.urlencode())
+
+
+class KeysetPaginator:
+    """
+    Cursor (keyset) pagination: pages are selected by comparing the ordering fields with the values
+    of the first/last row of the neighbouring page instead of using OFFSET, so every page costs
+    the same single index range scan. The last ordering field must be unique (usually '-pk' or 'pk').
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.per_page = per_page
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+    def get_cursor(self, obj):
+        values = [getattr(obj, name) for name, _ in self.fields]
+        return encode_cursor([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+
+    def parse_cursor(self, cursor):
+        values = decode_cursor(cursor)
+        if len(values) != len(self.fields):
+            raise Http404("Invalid page cursor")
+
+        opts = self.queryset.model._meta
+        try:
+            return [(opts.pk if name == 'pk' else opts.get_field(name)).to_python(value)
+                    for (name, _), value in zip(self.fields, values)]
+        except (FieldDoesNotExist, ValidationError):
+            raise Http404("Invalid page cursor")
+
+    def keyset_filter(self, values, forward):
+        """
+        Build f1 >= v1 AND ((f1 > v1) OR (f1 = v1 AND f2 > v2) OR ...) where the comparison direction
+        follows each field's ordering and is flipped when moving backward. The standalone bound
+        on the leading field lets the database start an index range scan at the cursor.
+        """
+        condition = Q()
+        for i, (name, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending == forward else 'gt'
+            prefix = {field_name: value for (field_name, _), value in zip(self.fields[:i], values)}
+            condition |= Q(**prefix, **{f'{name}__{lookup}': values[i]})
+
+        if len(self.fields) > 1:
+            name, descending = self.fields[0]
+            lookup = 'lte' if descending == forward else 'gte'
+            condition = Q(**{f'{name}__{lookup}': values[0]}) & condition
+        return condition
+
+    def rows(self, cursor=None, forward=True):
+        """
+        Up to per_page + 1 rows next to the cursor (from the start without it), ordered
+        in the direction of moving: along the ordering forward and against it backward
+        """
+        ordering = self.ordering
+        if not forward:
+            ordering = [name[1:] if name.startswith('-') else '-' + name for name in ordering]
+
+        queryset = self.queryset
+        if cursor:
+            queryset = queryset.filter(self.keyset_filter(self.parse_cursor(cursor), forward=forward))
+        return list(queryset.order_by(*ordering)[:self.per_page + 1])
+
+    def page(self, after=None, before=None):
+        if before:
+            rows = self.rows(before, forward=False)
+            if not rows:
+                return self.page()
+
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(rows, next_cursor=self.get_cursor(rows[-1]),
+                              previous_cursor=self.get_cursor(rows[0]) if has_more else None)
+
+        rows = self.rows(after)
+
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return KeysetPage(rows, next_cursor=self.get_cursor(rows[-1]) if has_more else None,
+                          previous_cursor=self.get_cursor(rows[0]) if after and rows else None)
+
+
+def paginate_by_keyset(request, queryset, ordering, per_page):
+    """
+    Return the KeysetPage selected by the 'after'/'before' GET parameters of the request.
+    The page also carries query strings (with the rest of GET parameters preserved) for its neighbours.
+    """
+    paginator = KeysetPaginator(queryset, ordering, per_page)
+    page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+    page.set_querystrings(request.GET)
+    return page
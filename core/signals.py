@@ -0,0 +1,27 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from profiles.models import Profile
+from .models import UnreadCounter
+from .backends import invalidate_user
+
+
+# create unread counters when new user is registered
+@receiver(post_save, sender=User)
+def create_unread_counter(sender, instance, created, **kwargs):
+    if created:
+        UnreadCounter.objects.create(user=instance)
+
+
+# drop the cached user of the authentication backend when the user or the profile change
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_when_user_change(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_user_when_profile_change(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
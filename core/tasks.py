@@ -0,0 +1,8 @@
+from . import counters
+
+from forum.celery import app
+
+
+@app.task
+def reconcile_unread_counters():
+    counters.reconcile_unread_counters()
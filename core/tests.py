@@ -1,3 +1,197 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from discussions.models import Category, Topic, Post
+from feed.models import Subscription
+from feed.read_marks import mark_read
+from feed.tasks import fan_out_post, backfill_feed
+from messaging.models import Message
+from messaging.mailbox import set_read, move_to_bucket, restore
+from . import identity_map
+from .backends import user_cache_key
+from .models import UnreadCounter
+from .views import IndexView
+
+
+class IndexViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(category_name="Test Category")
+        self.user = User.objects.create_user(username='testuser1', password='1X<ISRUkw+tuK')
+
+    def test_topic_lists_are_cached_until_topic_change(self):
+        Topic.objects.create(category=self.category, topic_title='First Topic', last_active_user=self.user)
+        response = self.client.get(reverse('core:index'))
+        self.assertContains(response, 'First Topic')
+
+        # anonymous visitors are served without queries
+        with self.assertNumQueries(0):
+            self.client.get(reverse('core:index'))
+
+        Topic.objects.create(category=self.category, topic_title='Second Topic', last_active_user=self.user)
+        self.assertContains(self.client.get(reverse('core:index')), 'Second Topic')
+
+    def test_users_directory_is_paginated_for_superusers(self):
+        User.objects.create_superuser(username='admin', password='2HJ1vRV0Z&3iD', email='admin@example.com')
+        for i in range(IndexView.users_paginate_by + 5):
+            User.objects.create_user(username=f'user{i:03}')
+
+        response = self.client.get(reverse('core:index'))
+        self.assertNotIn('users_list', response.context)
+
+        self.client.login(username='admin', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('core:index'))
+        users = response.context['users_list']
+        self.assertEqual(len(users), IndexView.users_paginate_by)
+        self.assertEqual(users[0].username, 'admin')
+
+        response = self.client.get(reverse('core:index') + '?' + response.context['users_page'].next_querystring)
+        self.assertEqual([user.username for user in response.context['users_list']][-1], 'user054')
+        self.assertEqual(len(response.context['users_list']), 7)
+
+
+class UnreadCounterTests(TestCase):
+
+    def setUp(self):
+        self.reader = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+        self.writer = User.objects.create_user(username='writer', password='2HJ1vRV0Z&3iD')
+
+    def get_counter(self):
+        return UnreadCounter.objects.get(user=self.reader)
+
+    def test_feed_posts_counter(self):
+        topic = Topic.objects.create(topic_title="Topic", category=Category.objects.create(category_name="Category"))
+        Subscription.objects.create(user=self.reader, topic=topic)
+        posts = [Post.objects.create(topic=topic, post_body=f"Post {i}", author=self.writer) for i in range(3)]
+        for post in posts:
+            fan_out_post(post.pk)
+        self.assertEqual(self.get_counter().feed_posts, 3)
+
+        mark_read(self.reader, posts[0])
+        self.assertEqual(self.get_counter().feed_posts, 2)
+
+        self.client.login(username='reader', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('core:index'))
+        self.assertContains(response, '<span class="badge badge-light">2</span>', html=True)
+
+    def test_feed_posts_counter_counts_only_inserted_entries(self):
+        topic = Topic.objects.create(topic_title="Topic", category=Category.objects.create(category_name="Category"))
+        subscription = Subscription.objects.create(user=self.reader, topic=topic)
+        posts = [Post.objects.create(topic=topic, post_body=f"Post {i}", author=self.writer) for i in range(3)]
+        # the backfill of the new subscription overlaps with the fan-out and a retried task
+        backfill_feed(subscription.pk)
+        for post in posts:
+            fan_out_post(post.pk)
+        fan_out_post(posts[0].pk)
+        self.assertEqual(self.get_counter().feed_posts, 3)
+
+        posts[0].delete()
+        self.assertEqual(self.get_counter().feed_posts, 2)
+        # the posts are deleted by the cascade
+        topic.delete()
+        self.assertEqual(self.get_counter().feed_posts, 0)
+
+    def test_messages_counter(self):
+        messages = [Message.objects.create(sender=self.writer, receiver=self.reader, subject=f"Message {i}")
+                    for i in range(3)]
+        self.assertEqual(self.get_counter().messages, 3)
+
+        set_read(self.reader, messages[0].pk, True)
+        move_to_bucket(self.reader, messages[0].pk)
+        move_to_bucket(self.reader, messages[1].pk)
+        # the sender's changes don't change the receiver's counter
+        set_read(self.writer, messages[2].pk, True)
+        self.assertEqual(self.get_counter().messages, 1)
+
+        set_read(self.reader, messages[0].pk, False)
+        restore(self.reader, messages[1])
+        self.assertEqual(self.get_counter().messages, 2)
+
+    def test_reconcile_unread_counters_command(self):
+        UnreadCounter.objects.all().delete()
+        Message.objects.create(sender=self.writer, receiver=self.reader, subject="Message")
+
+        out = StringIO()
+        call_command('reconcile_unread_counters', batch_size=1, stdout=out)
+
+        self.assertEqual(self.get_counter().messages, 1)
+        self.assertEqual(UnreadCounter.objects.get(user=self.writer).messages, 0)
+        self.assertIn("Fixed unread counters of 1 users", out.getvalue())
+
+
+class ProfileModelBackendTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user', password='1X<ISRUkw+tuK')
+        self.client.login(username='user', password='1X<ISRUkw+tuK')
+
+    def test_user_is_loaded_with_profile_and_cached(self):
+        self.client.get(reverse('feed:feed'))
+
+        # session, feed entries, pulled posts, user's unread counters
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('feed:feed'))
+        self.assertEqual(response.context['user'], self.user)
+
+    def test_cached_user_has_no_password_hash(self):
+        self.client.get(reverse('feed:feed'))
+        cached, _ = cache.get(user_cache_key(self.user.pk))
+        self.assertNotIn('password', cached.__dict__)
+
+        # the session is verified with the cached session hash
+        response = self.client.get(reverse('feed:feed'))
+        self.assertEqual(response.context['user'], self.user)
+
+        response = self.client.post(reverse('registration:password_change'), {
+            'old_password': '1X<ISRUkw+tuK', 'new_password1': '2HJ1vRV0Z&3iD', 'new_password2': '2HJ1vRV0Z&3iD'})
+        self.assertEqual(response.status_code, 302)
+        # the session stays valid after the password change
+        response = self.client.get(reverse('feed:feed'))
+        self.assertEqual(response.context['user'], self.user)
+
+    def test_cached_user_is_invalidated_when_profile_changes(self):
+        self.client.get(reverse('feed:feed'))
+        self.user.profile.user_location = "New city"
+        self.user.profile.save()
+
+        response = self.client.get(reverse('feed:feed'))
+        self.assertEqual(response.context['user'].profile.user_location, "New city")
+
+
+class IdentityMapTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='1X<ISRUkw+tuK')
+        self.other_user = User.objects.create_user(username='other', password='2HJ1vRV0Z&3iD')
+
+    def test_rows_are_loaded_once_per_request(self):
+        current_map = identity_map.start()
+        self.addCleanup(identity_map.clear)
+
+        with self.assertNumQueries(1):
+            user = identity_map.get_object(User, self.user.pk)
+            self.assertIs(identity_map.get_object(User, str(self.user.pk)), user)
+        self.assertEqual((current_map.hits, current_map.misses), (1, 1))
+
+        identity_map.clear()
+        with self.assertNumQueries(2):
+            identity_map.get_object(User, self.user.pk)
+            identity_map.get_object(User, self.user.pk)
+
+    def test_message_view_loads_message_once(self):
+        message = Message.objects.create(sender=self.other_user, receiver=self.user, subject="Message")
+        self.client.login(username='user', password='1X<ISRUkw+tuK')
 
-# Create your tests here.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('messaging:message', kwargs={'message_id': message.pk}))
+        self.assertEqual(response.status_code, 200)
+        message_queries = [query for query in queries if query['sql'].startswith('SELECT')
+                           and 'FROM "messaging_message"' in query['sql']]
+        self.assertEqual(len(message_queries), 1)
@@ -3,22 +3,31 @@ from django.views import generic
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
 
-from discussions.models import Topic
+from discussions.models import TopicLeaderboardEntry
+from discussions.leaderboards import get_index_leaderboards
+from .pagination import paginate_by_keyset
 
 
-class IndexView(generic.ListView):
+class IndexView(generic.TemplateView):
     template_name = 'core/index.html'
-    context_object_name = 'users_list'
-
-    def get_queryset(self):
-        return User.objects.all()
+    users_paginate_by = 50
 
     def get_context_data(self, **kwargs):
         context = super(IndexView, self).get_context_data(**kwargs)
         context['page_title'] = 'Forum website'
-        context['latest_updated_topics_list'] = Topic.objects.all()[:5]
-        context['new_topics_list'] = Topic.objects.all().order_by('-creation_date')[:5]
-        context['most_popular_topics_list'] = Topic.objects.all().order_by('-posts_amount')[:5]
+
+        # the topic lists are read from the precomputed leaderboards (cached), see discussions/leaderboards.py
+        leaderboards = get_index_leaderboards()
+        context['trending_topics_list'] = leaderboards[TopicLeaderboardEntry.TRENDING]
+        context['new_topics_list'] = leaderboards[TopicLeaderboardEntry.NEW]
+        context['most_popular_topics_list'] = leaderboards[TopicLeaderboardEntry.POPULAR]
+
+        # the users directory is shown to superusers only, a page at a time along the username index
+        if self.request.user.is_superuser:
+            users_page = paginate_by_keyset(self.request, User.objects.only('pk', 'username'), ('username',),
+                                            self.users_paginate_by)
+            context['users_list'] = users_page.object_list
+            context['users_page'] = users_page
         return context
 
 
@@ -8,11 +8,11 @@ class CategoryAdmin(admin.ModelAdmin):
 
 
 class TopicAdmin(admin.ModelAdmin):
-    list_display = ('topic_title', 'category', 'posts_amount', 'last_updated_date', 'last_active_user')
+    list_display = ('topic_title', 'category', 'author', 'posts_amount', 'last_updated_date', 'last_active_user')
 
 
 class PostAdmin(admin.ModelAdmin):
-    list_display = ('__str__', 'topic', 'votes', 'author')
+    list_display = ('__str__', 'topic', 'votes_score', 'votes_up', 'votes_down', 'author')
 
 
 class PostVotesAdmin(admin.ModelAdmin):
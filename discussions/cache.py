@@ -0,0 +1,107 @@
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import Category
+
+# the fragment also shows the author's username, which isn't tracked by the signals, so cached HTML
+# is refreshed at least this often (the avatar's thumbnails are a part of the fragment's key)
+POST_FRAGMENT_TIMEOUT = 60 * 60
+
+# categories rarely change, but are shown on every forum page. They are kept in the shared cache
+# until invalidated and also in the memory of each process, where a change made by another
+# process shows up within CATEGORIES_LOCAL_TIMEOUT seconds
+CATEGORIES_KEY = 'discussions:categories'
+CATEGORIES_TIMEOUT = 24 * 60 * 60
+CATEGORIES_LOCAL_TIMEOUT = 10
+
+# (expiration time, categories) of the process-local copy
+_local_categories = (0, None)
+
+
+def post_version_key(post_id):
+    return f'discussions:post:{post_id}:version'
+
+
+def post_fragment_key(post, version):
+    # a new avatar of the author gets new thumbnails' URLs (see profiles/tasks.py), so its posts are rendered again
+    avatar_hash = post.author.profile.avatar_hash if post.author else ''
+    return f'discussions:post:{post.pk}:fragment:{version}:{avatar_hash}'
+
+
+def invalidate_post_fragment(post_id):
+    """
+    Give the post a new random version, so the HTML cached under the old one is never read again.
+    Random versions (unlike counters) stay safe when the version key itself is evicted.
+    The version is changed once more after the transaction commits, so a concurrent request that
+    rendered not yet committed data in between doesn't leave a stale fragment behind.
+    """
+    key = post_version_key(post_id)
+    cache.set(key, uuid.uuid4().hex, POST_FRAGMENT_TIMEOUT)
+    transaction.on_commit(lambda: cache.set(key, uuid.uuid4().hex, POST_FRAGMENT_TIMEOUT))
+
+
+def get_post_fragments(posts):
+    """
+    Return {post id: rendered 'discussions/post_fragment.html'} for the given posts (with their authors'
+    profiles joined), rendering and caching only the posts that are missing in the cache
+    """
+    version_keys = {post.pk: post_version_key(post.pk) for post in posts}
+    versions = cache.get_many(version_keys.values())
+
+    for key in version_keys.values():
+        if key not in versions:
+            # add() doesn't overwrite a version set by a concurrent invalidation
+            new_version = uuid.uuid4().hex
+            added = cache.add(key, new_version, POST_FRAGMENT_TIMEOUT)
+            versions[key] = new_version if added else cache.get(key, new_version)
+
+    fragment_keys = {post.pk: post_fragment_key(post, versions[version_keys[post.pk]]) for post in posts}
+    cached_fragments = cache.get_many(fragment_keys.values())
+
+    fragments = {}
+    new_fragments = {}
+    for post in posts:
+        key = fragment_keys[post.pk]
+        if key in cached_fragments:
+            fragment = cached_fragments[key]
+        else:
+            fragment = new_fragments[key] = render_to_string('discussions/post_fragment.html', {'post': post})
+        fragments[post.pk] = mark_safe(fragment)
+
+    if new_fragments:
+        cache.set_many(new_fragments, POST_FRAGMENT_TIMEOUT)
+
+    return fragments
+
+
+def get_categories():
+    """Return the list of all categories (with their counters) from the process-local or the shared cache"""
+    global _local_categories
+    expires, categories = _local_categories
+    if time.monotonic() < expires:
+        return categories
+
+    categories = cache.get(CATEGORIES_KEY)
+    if categories is None:
+        categories = list(Category.objects.all())
+        cache.set(CATEGORIES_KEY, categories, CATEGORIES_TIMEOUT)
+
+    _local_categories = (time.monotonic() + CATEGORIES_LOCAL_TIMEOUT, categories)
+    return categories
+
+
+def drop_categories():
+    global _local_categories
+    _local_categories = (0, None)
+    cache.delete(CATEGORIES_KEY)
+
+
+def invalidate_categories():
+    # dropped once more after the commit, so a concurrent request doesn't cache uncommitted data
+    drop_categories()
+    transaction.on_commit(drop_categories)
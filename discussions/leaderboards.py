@@ -0,0 +1,128 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Topic, Post, TopicLeaderboardEntry
+
+# amount of topics shown on the index page for each board
+LEADERBOARD_SIZE = 5
+
+# amount of topics kept for each board by rebuild_leaderboards(), the topics which are updated
+# incrementally in between can make a board a bit longer until the next rebuild
+LEADERBOARD_CAPACITY = 100
+
+# the weight of a post in the trending score halves every TRENDING_HALF_LIFE,
+# posts older than TRENDING_WINDOW are not counted at all
+TRENDING_HALF_LIFE = timedelta(hours=12)
+TRENDING_WINDOW = timedelta(days=7)
+
+# the boards of the index page are cached together, score changes made by new posts
+# show up after the timeout, while topic changes invalidate the cache right away
+INDEX_LEADERBOARDS_KEY = 'discussions:leaderboards:index'
+INDEX_LEADERBOARDS_TIMEOUT = 60
+
+
+def get_leaderboard(board, limit=LEADERBOARD_SIZE):
+    """Return the top `limit` topics of the board, read with a single index range scan"""
+    entries = (TopicLeaderboardEntry.objects.filter(board=board).select_related('topic')
+               .order_by('-score', '-topic_id')[:limit])
+    return [entry.topic for entry in entries]
+
+
+def get_index_leaderboards():
+    """Return {board: top LEADERBOARD_SIZE topics} of all the boards, from the cache if possible"""
+    leaderboards = cache.get(INDEX_LEADERBOARDS_KEY)
+    if leaderboards is None:
+        leaderboards = {board: get_leaderboard(board) for board, _ in TopicLeaderboardEntry.BOARD_CHOICES}
+        cache.set(INDEX_LEADERBOARDS_KEY, leaderboards, INDEX_LEADERBOARDS_TIMEOUT)
+    return leaderboards
+
+
+def invalidate_index_leaderboards():
+    # deleted once more after the commit, so a concurrent request doesn't cache uncommitted data
+    cache.delete(INDEX_LEADERBOARDS_KEY)
+    transaction.on_commit(lambda: cache.delete(INDEX_LEADERBOARDS_KEY))
+
+
+def increment_score(board, topic_id, amount, get_initial_score):
+    """
+    Add `amount` to the topic's score on the board with a single UPDATE.
+    If the topic isn't on the board yet, it's added with the score returned by `get_initial_score()`.
+    """
+    entries = TopicLeaderboardEntry.objects.filter(board=board, topic_id=topic_id)
+    if not entries.update(score=F('score') + amount):
+        _, created = TopicLeaderboardEntry.objects.get_or_create(board=board, topic_id=topic_id,
+                                                                 defaults={'score': get_initial_score()})
+        if not created:
+            # a concurrent request has added the topic in between
+            entries.update(score=F('score') + amount)
+
+
+def record_topic_created(topic):
+    # new topics are ranked by their creation time
+    TopicLeaderboardEntry.objects.create(board=TopicLeaderboardEntry.NEW, topic=topic,
+                                         score=topic.creation_date.timestamp())
+
+
+def record_post_created(post):
+    increment_score(TopicLeaderboardEntry.TRENDING, post.topic_id, 1, lambda: 1)
+    # the counter of the topic is already updated by the signal
+    increment_score(TopicLeaderboardEntry.POPULAR, post.topic_id, 1,
+                    lambda: Topic.objects.values_list('posts_amount', flat=True).get(pk=post.topic_id))
+
+
+def record_post_deleted(post):
+    TopicLeaderboardEntry.objects.filter(board=TopicLeaderboardEntry.POPULAR,
+                                         topic_id=post.topic_id).update(score=F('score') - 1)
+
+
+def trending_scores(now=None):
+    """
+    Return {topic id: score} of the topics with posts inside TRENDING_WINDOW, where every post
+    is weighted by its age. Posts are counted per topic and hour, so the decay is computed
+    over a few aggregated rows instead of every post.
+    """
+    now = now or timezone.now()
+    half_life = TRENDING_HALF_LIFE.total_seconds()
+
+    buckets = (Post.objects.filter(creation_date__gte=now - TRENDING_WINDOW)
+               .annotate(hour=TruncHour('creation_date')).order_by()
+               .values('topic_id', 'hour').annotate(amount=Count('pk'))
+               .values_list('topic_id', 'hour', 'amount'))
+
+    scores = {}
+    for topic_id, hour, amount in buckets:
+        age = max((now - hour).total_seconds(), 0)
+        scores[topic_id] = scores.get(topic_id, 0) + amount * 0.5 ** (age / half_life)
+    return scores
+
+
+def replace_board(board, scores):
+    """Replace the board's entries with the top LEADERBOARD_CAPACITY of the {topic id: score} mapping"""
+    top = sorted(scores.items(), key=lambda item: (item[1], item[0]), reverse=True)[:LEADERBOARD_CAPACITY]
+    with transaction.atomic():
+        TopicLeaderboardEntry.objects.filter(board=board).delete()
+        TopicLeaderboardEntry.objects.bulk_create(
+            TopicLeaderboardEntry(board=board, topic_id=topic_id, score=score) for topic_id, score in top)
+
+
+def rebuild_leaderboards():
+    """
+    Recompute all the boards from the forum tables. Between the rebuilds the boards are
+    only changed incrementally by the signals, so this is where the trending scores decay
+    and the topics which fell out of the top are dropped.
+    """
+    popular = Topic.objects.order_by('-posts_amount', '-pk').values_list('pk', 'posts_amount')
+    replace_board(TopicLeaderboardEntry.POPULAR, dict(popular[:LEADERBOARD_CAPACITY]))
+
+    # ids grow with the creation date and, unlike it, are indexed
+    new = Topic.objects.order_by('-pk').values_list('pk', 'creation_date')
+    replace_board(TopicLeaderboardEntry.NEW,
+                  {pk: creation_date.timestamp() for pk, creation_date in new[:LEADERBOARD_CAPACITY]})
+
+    replace_board(TopicLeaderboardEntry.TRENDING, trending_scores())
+    invalidate_index_leaderboards()
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from discussions.models import Post, PostVotes
+
+
+def votes_subquery(aggregate, **filters):
+    votes = PostVotes.objects.filter(post=OuterRef('pk'), **filters).order_by().values('post')
+    return Coalesce(Subquery(votes.annotate(total=aggregate).values('total'), output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = "Recalculate the stored vote tallies of posts from the PostVotes table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Amount of posts updated per statement")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = Post.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        updated = 0
+
+        # one UPDATE with correlated aggregates per range of primary keys, so locks are held only briefly
+        for start in range(0, last_pk, batch_size):
+            with transaction.atomic():
+                updated += Post.objects.filter(pk__gt=start, pk__lte=start + batch_size).update(
+                    votes_up=votes_subquery(Count('pk'), vote_value__gt=0),
+                    votes_down=votes_subquery(Count('pk'), vote_value__lt=0),
+                    votes_score=votes_subquery(Sum('vote_value')),
+                )
+
+        self.stdout.write(self.style.SUCCESS(f"Updated vote tallies of {updated} posts"))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from discussions.models import Topic, Post
+
+
+class Command(BaseCommand):
+    help = "Fill the author, first_post and last_post of topics from their posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Amount of topics updated per statement")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = Topic.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        updated = 0
+
+        posts = Post.objects.filter(topic=OuterRef('pk'))
+        first_posts = posts.order_by('creation_date', 'pk')
+        last_posts = posts.order_by('-creation_date', '-pk')
+
+        # one UPDATE with correlated subqueries per range of primary keys, so locks are held only briefly
+        for start in range(0, last_pk, batch_size):
+            with transaction.atomic():
+                updated += Topic.objects.filter(pk__gt=start, pk__lte=start + batch_size).update(
+                    first_post_id=Subquery(first_posts.values('pk')[:1]),
+                    last_post_id=Subquery(last_posts.values('pk')[:1]),
+                    author_id=Subquery(first_posts.values('author_id')[:1]),
+                )
+
+        self.stdout.write(self.style.SUCCESS(f"Updated first and last posts of {updated} topics"))
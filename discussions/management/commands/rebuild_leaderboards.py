@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from discussions.leaderboards import rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    help = "Recalculate the trending, new and most popular topic leaderboards"
+
+    def handle(self, *args, **options):
+        rebuild_leaderboards()
+        self.stdout.write(self.style.SUCCESS("Leaderboards are rebuilt"))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from discussions.models import Category, Topic, Post
+
+
+class Command(BaseCommand):
+    help = "Recalculate topics_amount of categories and posts_amount of topics"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Amount of rows reconciled per transaction")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        fixed_topics = self.reconcile(Topic, 'posts_amount', Post, 'topic', batch_size)
+        fixed_categories = self.reconcile(Category, 'topics_amount', Topic, 'category', batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f"Fixed posts_amount of {fixed_topics} topics "
+                                             f"and topics_amount of {fixed_categories} categories"))
+
+    def reconcile(self, model, counter_field, child_model, child_fk, batch_size):
+        """
+        Walk over `model` in primary key order and fix `counter_field` with the amount of related `child_model` rows.
+        Each chunk is locked while it's reconciled, so concurrent counter updates made by the signals
+        are applied on top of the recalculated values instead of being lost.
+        """
+        last_pk = 0
+        fixed = 0
+
+        while True:
+            with transaction.atomic():
+                stored = dict(model.objects.select_for_update().filter(pk__gt=last_pk).order_by('pk')
+                              .values_list('pk', counter_field)[:batch_size])
+                if not stored:
+                    return fixed
+
+                # a single aggregate query per chunk
+                actual = dict(child_model.objects.filter(**{f'{child_fk}__in': list(stored)}).order_by()
+                              .values(child_fk).annotate(amount=Count('pk')).values_list(child_fk, 'amount'))
+
+                changed = [model(pk=pk, **{counter_field: actual.get(pk, 0)})
+                           for pk, amount in stored.items() if amount != actual.get(pk, 0)]
+                model.objects.bulk_update(changed, [counter_field])
+
+            fixed += len(changed)
+            last_pk = max(stored)
@@ -19,16 +19,23 @@ class Topic(models.Model):
     posts_amount = models.IntegerField(default=0)
     last_active_user = models.ForeignKey(User, on_delete=models.SET_NULL, related_name="last_active_in_topics",
                                          null=True)
+    # denormalized, so topic lists get them with joins; first_post and last_post are maintained by the Post signals
+    author = models.ForeignKey(User, on_delete=models.SET_NULL, related_name="started_topics", null=True, blank=True)
+    first_post = models.ForeignKey('Post', on_delete=models.SET_NULL, related_name="+", null=True, blank=True)
+    last_post = models.ForeignKey('Post', on_delete=models.SET_NULL, related_name="+", null=True, blank=True)
+    # posts of topics with too many subscribers aren't copied to the subscribers' feeds, see feed/tasks.py
+    feed_pull = models.BooleanField(default=False)
 
     def __str__(self):
         return self.topic_title
 
-    @property
-    def author(self):
-        return self.posts.first().author
-
     class Meta:
         ordering = ['-last_updated_date']
+        # support keyset pagination of the topics lists, see ForumView
+        indexes = [
+            models.Index(fields=['last_updated_date', 'id']),
+            models.Index(fields=['category', 'last_updated_date', 'id']),
+        ]
 
 
 class Post(models.Model):
@@ -36,18 +43,57 @@ class Post(models.Model):
     creation_date = models.DateTimeField(auto_now_add=True)
     post_body = models.TextField()
     author = models.ForeignKey(User, on_delete=models.SET_NULL, related_name="author_of_posts", null=True)
+    # vote tallies are maintained by the PostVotes signals, see signals.py
+    votes_up = models.IntegerField(default=0)
+    votes_down = models.IntegerField(default=0)
+    votes_score = models.IntegerField(default=0)
 
     def __str__(self):
         return self.author.username + " -> " + str(self.pk)
 
     def votes(self):
-        return sum(PostVotes.objects.filter(post=self).values_list('vote_value', flat=True))
+        return self.votes_score
 
     class Meta:
         ordering = ['creation_date']
+        # support keyset pagination of the topic's posts (see TopicView) and of the author's activity
+        # (see profiles.views.UserActivityView)
+        indexes = [
+            models.Index(fields=['topic', 'creation_date', 'id']),
+            models.Index(fields=['author', '-creation_date', '-id']),
+        ]
 
 
 class PostVotes(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="user_votes")
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="post_votes")
     vote_value = models.IntegerField()
+
+
+class TopicLeaderboardEntry(models.Model):
+    """
+    A topic's score in one of the precomputed topic rankings shown on the index page, see leaderboards.py
+    """
+    POPULAR = 'popular'
+    NEW = 'new'
+    TRENDING = 'trending'
+    BOARD_CHOICES = [
+        (POPULAR, 'Most popular'),
+        (NEW, 'New'),
+        (TRENDING, 'Trending'),
+    ]
+
+    board = models.CharField(max_length=10, choices=BOARD_CHOICES)
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name="leaderboard_entries")
+    score = models.FloatField(default=0)
+
+    def __str__(self):
+        return f'{self.board}: {self.topic} ({self.score})'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['board', 'topic'], name='unique_leaderboard_topic'),
+        ]
+        indexes = [
+            models.Index(fields=['board', '-score', '-topic']),
+        ]
@@ -1,46 +1,128 @@
-from .models import Topic, Post
+from .models import Category, Topic, Post, PostVotes
+from .cache import invalidate_post_fragment, invalidate_categories
+from .leaderboards import (record_topic_created, record_post_created, record_post_deleted,
+                           invalidate_index_leaderboards)
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.db.models import F
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+# the cached categories list shows the names and counters of categories
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_categories_when_category_change(sender, instance, **kwargs):
+    invalidate_categories()
 
 
 # increase/decrease topics counter for categories when new topic is added/deleted, update category's last_updated_date
+# and put new topics on the leaderboards
+# every change is a single UPDATE with database-side arithmetic, so concurrent writers don't overwrite each other
 @receiver(post_save, sender=Topic)
 def update_category_when_topic_add(sender, instance, created, **kwargs):
     if created:
-        category = instance.category
-        category.topics_amount = F('topics_amount') + 1
-        category.save()
-        category.refresh_from_db()
+        Category.objects.filter(pk=instance.category_id).update(topics_amount=F('topics_amount') + 1,
+                                                                last_updated_date=instance.creation_date)
+
+        # keep the category instance attached to the topic (if any) in sync with the database
+        if Topic.category.is_cached(instance):
+            instance.category.topics_amount += 1
+            instance.category.last_updated_date = instance.creation_date
+
+        record_topic_created(instance)
+        invalidate_categories()
+
+
+# the index page shows titles and counters of topics, so its cached boards are dropped when a topic changes
+@receiver(post_save, sender=Topic)
+@receiver(post_delete, sender=Topic)
+def invalidate_leaderboards_when_topic_change(sender, instance, **kwargs):
+    invalidate_index_leaderboards()
 
 
 @receiver(post_delete, sender=Topic)
 def update_category_when_topic_delete(sender, instance, **kwargs):
-    category = instance.category
-    category.topics_amount = F('topics_amount') - 1
-    category.save()
-    category.refresh_from_db()
+    Category.objects.filter(pk=instance.category_id).update(topics_amount=F('topics_amount') - 1)
+    invalidate_categories()
+
+    if Topic.category.is_cached(instance):
+        instance.category.topics_amount -= 1
 
 
-# increase/decrease posts counter for topics when new post is added/deleted, update topic's last_updated_date
+# increase/decrease posts counter for topics when new post is added/deleted, update topic's last_updated_date,
+# author (the author of the first post), first and last posts and the topic's leaderboard scores, drop the cached rendering of the post
 @receiver(post_save, sender=Post)
 def update_topic_when_post_add(sender, instance, created, **kwargs):
+    invalidate_post_fragment(instance.pk)
+
     if created:
-        topic = instance.topic
-        topic.posts_amount = F('posts_amount') + 1
-        topic.last_active_user = instance.author
-        topic.save()
-        topic.refresh_from_db()
+        Topic.objects.filter(pk=instance.topic_id).update(posts_amount=F('posts_amount') + 1,
+                                                          last_active_user_id=instance.author_id,
+                                                          last_updated_date=instance.creation_date,
+                                                          author_id=Coalesce('author_id', Value(instance.author_id)),
+                                                          first_post_id=Coalesce('first_post_id', Value(instance.pk)),
+                                                          last_post_id=instance.pk)
+        Category.objects.filter(topics__pk=instance.topic_id).update(last_updated_date=instance.creation_date)
+
+        # keep the topic instance attached to the post (if any) in sync with the database
+        if Post.topic.is_cached(instance):
+            topic = instance.topic
+            topic.posts_amount += 1
+            topic.last_active_user_id = instance.author_id
+            topic.last_updated_date = instance.creation_date
+            topic.last_post = instance
+            if topic.first_post_id is None:
+                topic.first_post = instance
+            if topic.author_id is None:
+                topic.author_id = instance.author_id
 
-        category = topic.category
-        category.last_updated_date = instance.creation_date
-        category.save()
+        record_post_created(instance)
 
 
 @receiver(post_delete, sender=Post)
 def update_topic_when_post_delete(sender, instance, **kwargs):
-    topic = instance.topic
-    topic.posts_amount = F('posts_amount') - 1
-    topic.save()
-    topic.refresh_from_db()
+    invalidate_post_fragment(instance.pk)
+
+    Topic.objects.filter(pk=instance.topic_id).update(posts_amount=F('posts_amount') - 1)
+
+    # the first/last post reference of the topic is already nulled by on_delete=SET_NULL,
+    # the neighbouring post takes its place
+    remaining_posts = Post.objects.filter(topic=OuterRef('pk')).values('pk')
+    Topic.objects.filter(pk=instance.topic_id, first_post__isnull=True).update(
+        first_post_id=Subquery(remaining_posts.order_by('creation_date', 'pk')[:1]))
+    Topic.objects.filter(pk=instance.topic_id, last_post__isnull=True).update(
+        last_post_id=Subquery(remaining_posts.order_by('-creation_date', '-pk')[:1]))
+    record_post_deleted(instance)
+
+    if Post.topic.is_cached(instance):
+        instance.topic.posts_amount -= 1
+
+
+def change_post_votes(vote, sign):
+    """
+    Apply (sign=1) or revert (sign=-1) the vote to the post's stored tallies with a single UPDATE
+    """
+    tally_field = 'votes_up' if vote.vote_value > 0 else 'votes_down'
+    Post.objects.filter(pk=vote.post_id).update(**{
+        tally_field: F(tally_field) + sign,
+        'votes_score': F('votes_score') + sign * vote.vote_value,
+    })
+
+    # the rendered post shows the votes score
+    invalidate_post_fragment(vote.post_id)
+
+    # keep the post instance attached to the vote (if any) in sync with the database
+    if PostVotes.post.is_cached(vote):
+        vote.post.refresh_from_db(fields=['votes_up', 'votes_down', 'votes_score'])
+
+
+# increase/decrease post's vote tallies when a vote is added/deleted
+@receiver(post_save, sender=PostVotes)
+def update_post_when_vote_add(sender, instance, created, **kwargs):
+    if created:
+        change_post_votes(instance, 1)
+
 
+@receiver(post_delete, sender=PostVotes)
+def update_post_when_vote_delete(sender, instance, **kwargs):
+    change_post_votes(instance, -1)
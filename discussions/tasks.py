@@ -0,0 +1,8 @@
+from .leaderboards import rebuild_leaderboards
+
+from forum.celery import app
+
+
+@app.task
+def rebuild_topic_leaderboards():
+    rebuild_leaderboards()
@@ -1,11 +1,17 @@
 import mock
 import datetime
+from io import StringIO
 
+from django.db import connection
 from django.utils import timezone
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
 from django.contrib.auth.models import User
 
-from ..models import Category, Topic, Post, PostVotes
+from ..models import Category, Topic, Post, PostVotes, TopicLeaderboardEntry
+from ..leaderboards import get_leaderboard, rebuild_leaderboards, LEADERBOARD_CAPACITY
+from search.backends import INDEX_TABLE
 
 
 class CategoryModelTests(TestCase):
@@ -91,6 +97,154 @@ class TopicModelTests(TestCase):
             test_topic.save()
         self.assertEqual(test_topic.last_updated_date, testtime)
 
+    def test_post_creation_updates_counters_with_single_statements(self):
+        test_topic = Topic.objects.get(topic_title='Test Topic')
+        test_user2 = User.objects.get(username='testuser2')
+
+        # the first post also puts the topic on the trending and popular leaderboards
+        Post.objects.create(topic=test_topic, post_body="Body of the first post", author=test_user2)
+
+        with CaptureQueriesContext(connection) as queries:
+            post = Post.objects.create(topic=test_topic, post_body="Body of post", author=test_user2)
+
+        # INSERT of the post, UPDATE of the topic, UPDATE of the category, UPDATEs of the trending and popular
+        # scores, UPDATE of the author's profile; the search index writes depend on the database backend
+        own_queries = [query for query in queries.captured_queries if INDEX_TABLE not in query['sql']]
+        self.assertEqual(len(own_queries), 6, '\n'.join(query['sql'] for query in own_queries))
+
+        test_topic.refresh_from_db()
+        self.assertEqual(test_topic.posts_amount, 2)
+        self.assertEqual(test_topic.last_active_user, test_user2)
+        self.assertEqual(test_topic.last_updated_date, post.creation_date)
+        self.assertEqual(test_topic.category.last_updated_date, post.creation_date)
+
+        post.delete()
+        test_topic.refresh_from_db()
+        self.assertEqual(test_topic.posts_amount, 1)
+
+    def test_topic_creation_and_deletion_update_category_counter(self):
+        test_category = Category.objects.get(category_name="Test Category")
+        test_user = User.objects.get(username='testuser1')
+        topic = Topic.objects.create(category=test_category, topic_title='Topic0', last_active_user=test_user)
+
+        test_category.refresh_from_db()
+        self.assertEqual(test_category.topics_amount, 2)
+
+        topic.delete()
+        test_category.refresh_from_db()
+        self.assertEqual(test_category.topics_amount, 1)
+
+    def test_first_and_last_posts_are_maintained(self):
+        test_topic = Topic.objects.get(topic_title='Test Topic')
+        test_user = User.objects.get(username='testuser1')
+        first, middle, last = [Post.objects.create(topic=test_topic, post_body=f"Body of post #{i}", author=test_user)
+                               for i in range(3)]
+
+        test_topic.refresh_from_db()
+        self.assertEqual((test_topic.first_post, test_topic.last_post), (first, last))
+
+        first.delete()
+        last.delete()
+        test_topic.refresh_from_db()
+        self.assertEqual((test_topic.first_post, test_topic.last_post), (middle, middle))
+
+    def test_topic_author_is_set_by_the_first_post(self):
+        test_topic = Topic.objects.get(topic_title='Test Topic')
+        test_user1 = User.objects.get(username='testuser1')
+        test_user2 = User.objects.get(username='testuser2')
+        self.assertIsNone(test_topic.author)
+
+        Post.objects.create(topic=test_topic, post_body="First post", author=test_user1)
+        post = Post.objects.create(topic=test_topic, post_body="Reply", author=test_user2)
+        self.assertEqual(post.topic.author, test_user1)
+
+        test_topic.refresh_from_db()
+        self.assertEqual(test_topic.author, test_user1)
+
+    def test_backfill_topic_posts_command(self):
+        test_topic = Topic.objects.get(topic_title='Test Topic')
+        test_user = User.objects.get(username='testuser1')
+        # bulk_create bypasses the signals
+        first, last = Post.objects.bulk_create([Post(topic=test_topic, post_body=f"Body of post #{i}", author=test_user)
+                                                for i in range(2)])
+
+        out = StringIO()
+        call_command('backfill_topic_posts', batch_size=1, stdout=out)
+
+        test_topic.refresh_from_db()
+        self.assertEqual(test_topic.author, test_user)
+        self.assertEqual((test_topic.first_post, test_topic.last_post), (first, last))
+        self.assertIn("Updated first and last posts of 1 topics", out.getvalue())
+
+    def test_reconcile_forum_counters_command(self):
+        test_category = Category.objects.get(category_name="Test Category")
+        test_topic = Topic.objects.get(topic_title='Test Topic')
+        test_user = User.objects.get(username='testuser1')
+
+        # bulk_create bypasses the signals, so the stored counters are stale
+        Post.objects.bulk_create([Post(topic=test_topic, post_body=f"Body of post #{i}", author=test_user)
+                                  for i in range(3)])
+        Topic.objects.bulk_create([Topic(category=test_category, topic_title=f'Topic{i}', last_active_user=test_user)
+                                   for i in range(2)])
+
+        out = StringIO()
+        call_command('reconcile_forum_counters', batch_size=1, stdout=out)
+
+        test_topic.refresh_from_db()
+        test_category.refresh_from_db()
+        self.assertEqual(test_topic.posts_amount, 3)
+        self.assertEqual(test_category.topics_amount, 3)
+        self.assertIn("Fixed posts_amount of 1 topics and topics_amount of 1 categories", out.getvalue())
+
+
+class TopicLeaderboardTests(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(category_name="Test Category")
+        self.user = User.objects.create_user(username='testuser1', password='1X<ISRUkw+tuK')
+
+    def create_topic(self, title, posts_amount):
+        topic = Topic.objects.create(category=self.category, topic_title=title, last_active_user=self.user)
+        for i in range(posts_amount):
+            Post.objects.create(topic=topic, post_body=f"Body of post #{i}", author=self.user)
+        return topic
+
+    def test_leaderboards_are_updated_incrementally(self):
+        quiet = self.create_topic('Quiet', 1)
+        busy = self.create_topic('Busy', 3)
+
+        self.assertEqual(get_leaderboard(TopicLeaderboardEntry.NEW), [busy, quiet])
+        self.assertEqual(get_leaderboard(TopicLeaderboardEntry.POPULAR), [busy, quiet])
+        self.assertEqual(get_leaderboard(TopicLeaderboardEntry.TRENDING), [busy, quiet])
+
+        for i in range(3):
+            Post.objects.create(topic=quiet, post_body=f"Body of new post #{i}", author=self.user)
+        self.assertEqual(get_leaderboard(TopicLeaderboardEntry.POPULAR), [quiet, busy])
+
+        Post.objects.filter(topic=quiet).first().delete()
+        entry = TopicLeaderboardEntry.objects.get(board=TopicLeaderboardEntry.POPULAR, topic=quiet)
+        self.assertEqual(entry.score, 3)
+
+    def test_rebuild_decays_trending_scores(self):
+        old = self.create_topic('Old', 3)
+        recent = self.create_topic('Recent', 1)
+        Post.objects.filter(topic=old).update(creation_date=timezone.now() - datetime.timedelta(days=2))
+
+        rebuild_leaderboards()
+
+        self.assertEqual(get_leaderboard(TopicLeaderboardEntry.TRENDING), [recent, old])
+        self.assertEqual(get_leaderboard(TopicLeaderboardEntry.POPULAR), [old, recent])
+        self.assertEqual(get_leaderboard(TopicLeaderboardEntry.NEW), [recent, old])
+
+    def test_rebuild_trims_leaderboards(self):
+        Topic.objects.bulk_create([Topic(category=self.category, topic_title=f'Topic{i}', last_active_user=self.user)
+                                   for i in range(LEADERBOARD_CAPACITY + 10)])
+
+        rebuild_leaderboards()
+
+        self.assertEqual(TopicLeaderboardEntry.objects.filter(board=TopicLeaderboardEntry.NEW).count(),
+                         LEADERBOARD_CAPACITY)
+
 
 class PostModelTests(TestCase):
 
@@ -130,3 +284,34 @@ class PostModelTests(TestCase):
         vote1 = PostVotes.objects.create(user=test_user2, post=test_post, vote_value=-1)
         vote2 = PostVotes.objects.create(user=test_user3, post=test_post, vote_value=1)
         self.assertEqual(test_post.votes(), 0)
+
+    def test_correctness_of_votes_tallies(self):
+        test_user1 = User.objects.get(username='testuser1')
+        test_user2 = User.objects.get(username='testuser2')
+        test_user3 = User.objects.get(username='testuser3')
+        test_post = Post.objects.get(post_body=f"Body of post", author=test_user1)
+
+        PostVotes.objects.create(user=test_user2, post=test_post, vote_value=1)
+        vote = PostVotes.objects.create(user=test_user3, post=test_post, vote_value=-1)
+        test_post.refresh_from_db()
+        self.assertEqual((test_post.votes_up, test_post.votes_down, test_post.votes_score), (1, 1, 0))
+
+        vote.delete()
+        test_post.refresh_from_db()
+        self.assertEqual((test_post.votes_up, test_post.votes_down, test_post.votes_score), (1, 0, 1))
+
+    def test_backfill_post_votes_command(self):
+        test_user1 = User.objects.get(username='testuser1')
+        test_user2 = User.objects.get(username='testuser2')
+        test_user3 = User.objects.get(username='testuser3')
+        test_post = Post.objects.get(post_body=f"Body of post", author=test_user1)
+
+        # bulk_create bypasses the signals, so the stored tallies are stale
+        PostVotes.objects.bulk_create([PostVotes(user=test_user2, post=test_post, vote_value=1),
+                                       PostVotes(user=test_user3, post=test_post, vote_value=1)])
+        test_post.refresh_from_db()
+        self.assertEqual(test_post.votes_score, 0)
+
+        call_command('backfill_post_votes', batch_size=1, stdout=StringIO())
+        test_post.refresh_from_db()
+        self.assertEqual((test_post.votes_up, test_post.votes_down, test_post.votes_score), (2, 0, 2))
@@ -1,10 +1,15 @@
 import json
 
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from django.contrib.auth.models import User
 from ..models import Category, Topic, Post, PostVotes
+from ..views import TopicView
+from ..cache import drop_categories
 from feed.models import Subscription
 
 
@@ -248,6 +253,11 @@ class CreateTopicViewTest(TransactionTestCase):
         self.assertEqual(len(topics_list), 2)
         self.assertTrue(topics_list[0].topic_title == "New Topic")
 
+        new_topic = topics_list[0]
+        self.assertEqual(new_topic.author.username, 'testuser')
+        self.assertEqual(new_topic.first_post.post_body, "Body of the new post")
+        self.assertEqual(new_topic.first_post, new_topic.last_post)
+
     def test_create_topic_view_unsuccessful_post_creation(self):
         response = self.client.get(reverse('discussions:category', kwargs={'category_id': 1}))
         self.assertEqual(response.status_code, 200)
@@ -351,3 +361,185 @@ class VotePostViewTest(TransactionTestCase):
         self.assertJSONEqual(response.content, {'votes': 1, 'prev_vote': 1})
 
 
+class ForumViewQueriesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_category = Category.objects.create(category_name="Test Category")
+        test_user = User.objects.create_user(username='testuser', password='1X<ISRUkw+tuK')
+        for topic_id in range(5):
+            topic = Topic.objects.create(topic_title=f"Topic {topic_id}", category=test_category,
+                                         last_active_user=test_user, author=test_user)
+            Post.objects.create(topic=topic, post_body="First post", author=test_user)
+            Post.objects.create(topic=topic, post_body="Last post", author=test_user)
+
+    def setUp(self):
+        # the rollbacks of the previous tests don't invalidate the categories cache
+        drop_categories()
+
+    def test_forum_view_loads_authors_and_last_posts_with_joins(self):
+        self.client.get(reverse('discussions:forum'))
+
+        # topics with authors, profiles and last posts, the categories come from the cache
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('discussions:forum'))
+        self.assertEqual(len(response.context['topics']), 5)
+        self.assertContains(response, 'Last post: testuser', count=5)
+
+    def test_category_view_reads_category_from_cache(self):
+        category = Category.objects.get(category_name="Test Category")
+        self.client.get(reverse('discussions:forum'))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('discussions:category', kwargs={'category_id': category.pk}))
+        self.assertEqual(response.context['category_name'], "Test Category")
+        self.assertContains(response, 'Test Category (5)')
+
+        response = self.client.get(reverse('discussions:category', kwargs={'category_id': category.pk + 100}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_categories_cache_is_invalidated_by_topic_creation(self):
+        category = Category.objects.get(category_name="Test Category")
+        self.client.get(reverse('discussions:forum'))
+
+        Topic.objects.create(topic_title="New Topic", category=category)
+        Category.objects.create(category_name="New Category")
+
+        response = self.client.get(reverse('discussions:forum'))
+        self.assertContains(response, 'Test Category (6)')
+        self.assertContains(response, 'New Category (0)')
+
+
+class TopicViewQueriesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_category = Category.objects.create(category_name="Test Category")
+        test_user1 = User.objects.create_user(username='testuser1', password='1X<ISRUkw+tuK')
+        test_user2 = User.objects.create_user(username='testuser2', password='1X<IMRUkw+tuK')
+
+        for number_of_posts in (10, 1000):
+            topic = Topic.objects.create(topic_title=f"Topic {number_of_posts}", category=test_category,
+                                         last_active_user=test_user1)
+            Post.objects.bulk_create([Post(topic=topic, post_body=f"Post {i}", author=test_user1 if i % 2 else test_user2)
+                                      for i in range(number_of_posts)])
+            PostVotes.objects.bulk_create([PostVotes(user=test_user2, post=post, vote_value=1)
+                                           for post in topic.posts.filter(author=test_user1)])
+
+    def assert_constant_topic_queries(self, num):
+        for number_of_posts in (10, 1000):
+            topic = Topic.objects.get(topic_title=f"Topic {number_of_posts}")
+            with self.assertNumQueries(num):
+                response = self.client.get(reverse('discussions:topic', kwargs={'topic_id': topic.pk}))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['posts_and_votes_list']), min(number_of_posts, TopicView.paginate_by))
+
+    def test_topic_view_queries_amount_does_not_depend_on_posts_amount_for_unlogged_users(self):
+        # topic, posts with authors and profiles
+        self.assert_constant_topic_queries(2)
+
+    def test_topic_view_queries_amount_does_not_depend_on_posts_amount_for_logged_users(self):
+        self.client.login(username='testuser2', password='1X<IMRUkw+tuK')
+        # the user with the profile is cached by the first request
+        self.client.get(reverse('discussions:forum'))
+        # session, topic, posts with authors and profiles, user's votes, subscription, user's unread counters
+        self.assert_constant_topic_queries(6)
+
+
+class TopicViewPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_category = Category.objects.create(category_name="Test Category")
+        test_user = User.objects.create_user(username='testuser', password='1X<ISRUkw+tuK')
+        cls.topic = Topic.objects.create(topic_title="Topic", category=test_category, last_active_user=test_user)
+        cls.number_of_posts = TopicView.paginate_by * 2 + 5
+        Post.objects.bulk_create([Post(topic=cls.topic, post_body=f"Post {i}", author=test_user)
+                                  for i in range(cls.number_of_posts)])
+
+    def get_page(self, **params):
+        response = self.client.get(reverse('discussions:topic', kwargs={'topic_id': self.topic.pk}), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['page_obj']
+
+    def test_topic_view_pages_cover_all_posts_newest_first(self):
+        page = self.get_page()
+        self.assertFalse(page.has_previous())
+        posts = list(page)
+
+        while page.has_next():
+            page = self.get_page(after=page.next_cursor)
+            self.assertTrue(page.has_previous())
+            posts.extend(page)
+
+        self.assertEqual([post.pk for post in posts],
+                         list(Post.objects.filter(topic=self.topic).order_by('-creation_date', '-pk')
+                              .values_list('pk', flat=True)))
+
+    def test_topic_view_previous_cursor_returns_previous_page(self):
+        first_page = self.get_page()
+        second_page = self.get_page(after=first_page.next_cursor)
+        page = self.get_page(before=second_page.previous_cursor)
+        self.assertEqual([post.pk for post in page], [post.pk for post in first_page])
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+    def test_topic_view_later_pages_cost_the_same_queries(self):
+        first_page = self.get_page()
+        second_page = self.get_page(after=first_page.next_cursor)
+        with self.assertNumQueries(2), CaptureQueriesContext(connection) as queries:
+            self.get_page(after=second_page.next_cursor)
+
+        # the leading ordering field is bounded on its own, so the page starts an index range scan
+        posts_sql = queries.captured_queries[-1]['sql']
+        self.assertIn('"discussions_post"."creation_date" <= ', posts_sql)
+        self.assertIn(' OR ', posts_sql)
+
+    def test_topic_view_invalid_cursor(self):
+        response = self.client.get(reverse('discussions:topic', kwargs={'topic_id': self.topic.pk}),
+                                   {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class TopicViewFragmentCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_category = Category.objects.create(category_name="Test Category")
+        test_user1 = User.objects.create_user(username='testuser1', password='1X<ISRUkw+tuK')
+        test_user2 = User.objects.create_user(username='testuser2', password='1X<IMRUkw+tuK')
+        cls.topic = Topic.objects.create(topic_title="Topic", category=test_category, last_active_user=test_user1)
+        cls.post = Post.objects.create(topic=cls.topic, post_body="Post body", author=test_user1)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_topic(self):
+        return self.client.get(reverse('discussions:topic', kwargs={'topic_id': self.topic.pk}))
+
+    def test_topic_view_renders_post_fragment_once(self):
+        response = self.get_topic()
+        self.assertTemplateUsed(response, 'discussions/post_fragment.html')
+        self.assertContains(response, "Post body")
+
+        response = self.get_topic()
+        self.assertTemplateNotUsed(response, 'discussions/post_fragment.html')
+        self.assertContains(response, "Post body")
+
+    def test_topic_view_post_fragment_invalidated_by_votes_and_post_changes(self):
+        self.get_topic()
+
+        vote = PostVotes.objects.create(user=User.objects.get(username='testuser2'), post=self.post, vote_value=1)
+        response = self.get_topic()
+        self.assertTemplateUsed(response, 'discussions/post_fragment.html')
+        self.assertContains(response, "Votes: <i>1</i>", html=False)
+
+        vote.delete()
+        self.assertContains(self.get_topic(), "Votes: <i>0</i>", html=False)
+
+        self.post.post_body = "Edited post body"
+        self.post.save()
+        self.assertContains(self.get_topic(), "Edited post body")
+
+    def test_topic_view_vote_buttons_are_not_cached(self):
+        self.get_topic()
+        self.client.login(username='testuser2', password='1X<IMRUkw+tuK')
+        response = self.get_topic()
+        self.assertTemplateNotUsed(response, 'discussions/post_fragment.html')
+        self.assertContains(response, 'class=\'vote btn btn-outline-success btn-sm\'', count=1)
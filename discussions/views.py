@@ -1,42 +1,52 @@
-from django.shortcuts import get_object_or_404
-from django.http import JsonResponse, HttpResponseNotFound
+from django.http import JsonResponse, HttpResponseNotFound, Http404
 from django.views import generic
 from django.views.generic.base import View
 
-from django.contrib.auth.models import User
 from django.shortcuts import render, redirect
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 
 from .forms import TopicForm, PostForm
 from .models import Category, Topic, Post, PostVotes
+from .cache import get_post_fragments, get_categories
 from feed.models import Subscription
 from core.views import CheckUserMixin
+from core import identity_map
+from core.pagination import paginate_by_keyset
 
 
-class ForumView(generic.ListView):
+class ForumView(generic.TemplateView):
     template_name = 'discussions/forum.html'
-    context_object_name = 'categories_list'
-
-    def get_queryset(self):
-        return Category.objects.all()
+    topics_paginate_by = 20
 
     def get_context_data(self, **kwargs):
         context = super(ForumView, self).get_context_data(**kwargs)
-        try:
-            context['topics'] = Topic.objects.filter(category_id=self.kwargs['category_id'])
-            category_name = Category.objects.get(pk=self.kwargs['category_id']).category_name
-            context['page_title'] = category_name + " - Forum"
-            context['category_name'] = category_name
-        except KeyError as e:
-            if 'category_id' in str(e):
-                context['topics'] = Topic.objects.all()
-                context['page_title'] = 'Forum'
+        # categories are read from the cache, see cache.py
+        context['categories_list'] = categories = get_categories()
+
+        # authors, last posts and the rest of the shown relations are loaded with joins
+        topics = Topic.objects.select_related('author__profile', 'last_post__author', 'last_active_user', 'category')
+        if 'category_id' in self.kwargs:
+            category = next((category for category in categories if category.pk == self.kwargs['category_id']), None)
+            if category is None:
+                raise Http404("Category does not exist")
+
+            topics = topics.filter(category_id=category.pk)
+            context['page_title'] = category.category_name + " - Forum"
+            context['category_name'] = category.category_name
+        else:
+            context['page_title'] = 'Forum'
 
+        topics_page = paginate_by_keyset(self.request, topics, ('-last_updated_date', '-pk'), self.topics_paginate_by)
+        context['topics'] = topics_page.object_list
+        context['page_obj'] = topics_page
         return context
 
 
 class TopicView(View):
+    paginate_by = 20
+
     def get(self, request, topic_id):
         return self.post_list_response(request, PostForm())
 
@@ -45,45 +55,46 @@ class TopicView(View):
         if post_form.is_valid():
             post = post_form.save(commit=False)
             post.author = request.user
-            post.topic = Topic.objects.get(pk=topic_id)
-            post.save()
+            post.topic = identity_map.get_object_or_404(Topic, topic_id)
+            # the counters of the topic and category are updated by the signals in the same transaction
+            with transaction.atomic():
+                post.save()
             return redirect('discussions:topic', topic_id=topic_id)
 
         return self.post_list_response(request, post_form)
 
     def post_list_response(self, request, post_form):
         topic_id = self.kwargs['topic_id']
-        posts_list = Post.objects.filter(topic_id=topic_id).order_by('-creation_date')
+        topic = identity_map.get_object_or_404(Topic, topic_id)
+        posts = Post.objects.filter(topic=topic).select_related('author__profile')
+        posts_page = paginate_by_keyset(request, posts, ('-creation_date', '-pk'), self.paginate_by)
+        posts_list = posts_page.object_list
+        # the viewer-independent part of each post is rendered from the cache, see cache.py
+        post_fragments = get_post_fragments(posts_list)
         is_subscribed = False
 
         # generating list with states of voting for each post in the list for the given user
         if not request.user.is_anonymous:
-            user_post_votes = []
-            for post in posts_list:
-                try:
-                    post_vote_value = PostVotes.objects.get(user=request.user, post=post).vote_value
-                except ObjectDoesNotExist:
-                    post_vote_value = 0
-                user_post_votes.append(post_vote_value)
+            # the user's votes for the whole topic in one query, keyed by post id
+            user_post_votes = dict(PostVotes.objects.filter(user=request.user, post__in=posts_list)
+                                   .values_list('post_id', 'vote_value'))
 
-            posts_with_vote_statuses = [[post, vote] for post, vote in zip(posts_list, user_post_votes)]
+            posts_with_vote_statuses = [[post, user_post_votes.get(post.pk, 0), post_fragments[post.pk]]
+                                        for post in posts_list]
 
-            try:
-                Subscription.objects.get(user=request.user, topic=topic_id)
-                is_subscribed = True
-            except ObjectDoesNotExist:
-                pass
+            is_subscribed = Subscription.objects.filter(user=request.user, topic=topic).exists()
 
         else:
-            posts_with_vote_statuses = [[post, None] for post in posts_list]
+            posts_with_vote_statuses = [[post, None, post_fragments[post.pk]] for post in posts_list]
 
         return render(request, 'discussions/topic.html', {
             'posts_and_votes_list': posts_with_vote_statuses,
+            'page_obj': posts_page,
             'post_form': post_form,
             'topic_id': topic_id,
-            'topic': Topic.objects.get(pk=topic_id),
+            'topic': topic,
             'is_subscribed': is_subscribed,
-            'page_title': Topic.objects.get(pk=topic_id).topic_title
+            'page_title': topic.topic_title
         })
 
 
@@ -100,14 +111,17 @@ class CreateTopicView(CheckUserMixin, View):
         post_form = PostForm(request.POST)
 
         if topic_form.is_valid() and post_form.is_valid():
-            topic = topic_form.save(commit=False)
-            topic.last_active_user = request.user
-            topic.save()
-
-            post = post_form.save(commit=False)
-            post.author = request.user
-            post.topic = topic
-            post.save()
+            # the topic's first_post is set by the signal of the post in the same transaction
+            with transaction.atomic():
+                topic = topic_form.save(commit=False)
+                topic.last_active_user = request.user
+                topic.author = request.user
+                topic.save()
+
+                post = post_form.save(commit=False)
+                post.author = request.user
+                post.topic = topic
+                post.save()
 
             return redirect('discussions:forum')
 
@@ -123,28 +137,32 @@ class VotePostView(CheckUserMixin, View):
 
         vote_value = 1 if direction == 'up' else -1
 
-        user = get_object_or_404(User, id=request.user.pk)
-        post = get_object_or_404(Post, id=post_id)
+        # the user is loaded by the authentication already
+        user = request.user
+        post = identity_map.get_object_or_404(Post, post_id)
 
-        if user == post.author:
+        if user.pk == post.author_id:
             return HttpResponseNotFound("Bad request")
 
-        try:
-            post_votes_obj = PostVotes.objects.get(user=request.user, post=post)
-            previous_vote = post_votes_obj.vote_value
+        with transaction.atomic():
+            try:
+                # fetched through the related manager, so the vote keeps a reference to `post`
+                # and the signal handlers refresh its tallies
+                post_votes_obj = post.post_votes.get(user=request.user)
+                previous_vote = post_votes_obj.vote_value
 
-            # in case that the doubled  ajax request was sent somehow
-            if previous_vote == vote_value:
-                return HttpResponseNotFound("Bad request")
+                # in case that the doubled  ajax request was sent somehow
+                if previous_vote == vote_value:
+                    return HttpResponseNotFound("Bad request")
 
-            post_votes_obj.delete()
+                post_votes_obj.delete()
 
-        except ObjectDoesNotExist:
-            PostVotes(user=user, post=post, vote_value=vote_value).save()
-            previous_vote = 0
+            except ObjectDoesNotExist:
+                PostVotes(user=user, post=post, vote_value=vote_value).save()
+                previous_vote = 0
 
         status = {
-            'votes': sum(PostVotes.objects.filter(post=post).values_list('vote_value', flat=True)),
+            'votes': post.votes_score,
             'prev_vote': previous_vote
         }
         return JsonResponse(status)
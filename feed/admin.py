@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Subscription, ReadPost
+from .models import Subscription, ReadPost, FeedDigest
 
 
 class SubscriptionAdmin(admin.ModelAdmin):
@@ -9,3 +9,4 @@ class SubscriptionAdmin(admin.ModelAdmin):
 
 admin.site.register(ReadPost)
 admin.site.register(Subscription, SubscriptionAdmin)
+admin.site.register(FeedDigest)
@@ -0,0 +1,99 @@
+import json
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# events of all the processes are published to this Redis channel
+FEED_EVENTS_CHANNEL = 'feed:events'
+
+
+class InProcessBroker:
+    """
+    Delivers the published events to the subscribers of the current process.
+    Events can be published from any thread, the callbacks are called in the event loops of the subscribers.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, loop, callback):
+        """Call `callback(event)` in the `loop` for every published event, return the unsubscribe function"""
+        token = object()
+        with self.lock:
+            self.subscribers[token] = (loop, callback)
+
+        def unsubscribe():
+            with self.lock:
+                self.subscribers.pop(token, None)
+        return unsubscribe
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+        for loop, callback in subscribers:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(callback, event)
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Shares events between the processes through Redis pub/sub: a single listener thread per process
+    receives them and delivers to the process' subscribers, so the amount of Redis connections
+    doesn't depend on the amount of streams
+    """
+
+    def __init__(self, url=None):
+        super().__init__()
+        self.redis = redis.Redis.from_url(url or settings.FEED_STREAM_REDIS_URL)
+        self.listener = None
+
+    def subscribe(self, loop, callback):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, name='feed-events-listener', daemon=True)
+                self.listener.start()
+        return super().subscribe(loop, callback)
+
+    def publish(self, event):
+        self.redis.publish(FEED_EVENTS_CHANNEL, json.dumps(event))
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(FEED_EVENTS_CHANNEL)
+                for message in pubsub.listen():
+                    self.handle_message(message)
+            except redis.ConnectionError:
+                # live streams miss the events published meanwhile, clients get them when they resume
+                time.sleep(1)
+            except Exception:
+                # the thread is the only listener of the process, it must outlive any error
+                logging.exception("Feed events listener failed, resubscribing")
+                time.sleep(1)
+
+    def handle_message(self, message):
+        """Deliver a received event, a broken one is logged and skipped"""
+        try:
+            self.deliver(json.loads(message['data']))
+        except Exception:
+            logging.exception("Failed to deliver a feed event: %r" % message.get('data'))
+
+
+_broker = None
+
+
+def get_broker():
+    """Return the broker of the current process, its class is set by the FEED_STREAM_BROKER setting"""
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.FEED_STREAM_BROKER)()
+    return _broker
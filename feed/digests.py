@@ -0,0 +1,134 @@
+"""
+Digest emails of the users' feeds. Digests are rendered for a batch of users at a time and sent
+over a single mail connection, which is reused for all the batches of a run.
+"""
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from discussions.models import Topic, Post
+from .models import Subscription, ReadPost, FeedEntry, FeedDigest
+
+# a user gets at most one digest in this window
+DIGEST_INTERVAL = datetime.timedelta(days=1)
+
+# users whose digests are rendered and sent at once
+DIGEST_BATCH_SIZE = 100
+
+# posts listed in a digest
+DIGEST_POSTS = 10
+
+
+def due_users(now):
+    """Active users with subscriptions, who haven't got a digest within the window"""
+    subscriptions = Subscription.objects.filter(user=OuterRef('pk'))
+    return User.objects.filter(is_active=True).exclude(email='') \
+        .filter(Exists(subscriptions)) \
+        .filter(Q(feed_digest__isnull=True) | Q(feed_digest__last_sent_at__lte=now - DIGEST_INTERVAL))
+
+
+# both sources of the feed (see read_marks.unread_entries and read_marks.unread_pulled_posts) for a batch
+# of users, the posts created after the users' last digests are ranked per user by a window function
+DIGEST_POSTS_SQL = """
+    SELECT user_id, post_id FROM (
+        SELECT feed.user_id, feed.post_id,
+               ROW_NUMBER() OVER (PARTITION BY feed.user_id ORDER BY feed.creation_date DESC, feed.post_id DESC) AS place
+        FROM (
+            SELECT e.user_id, e.post_id, e.creation_date FROM {entry} e WHERE e.user_id IN ({user_ids})
+            UNION
+            SELECT s.user_id, p.id, p.creation_date FROM {subscription} s
+            JOIN {topic} t ON t.id = s.topic_id JOIN {post} p ON p.topic_id = s.topic_id
+            WHERE s.user_id IN ({user_ids}) AND t.feed_pull = %s
+              AND p.creation_date > COALESCE(s.last_read_date, s.creation_date)
+              AND (p.author_id IS NULL OR p.author_id <> s.user_id)
+        ) feed
+        LEFT JOIN {digest} d ON d.user_id = feed.user_id
+        WHERE feed.creation_date > COALESCE(d.last_sent_at, %s)
+          AND NOT EXISTS (SELECT 1 FROM {read_post} r WHERE r.user_id = feed.user_id AND r.post_id = feed.post_id)
+    ) ranked WHERE place <= %s
+"""
+
+
+def digest_posts(user_ids, now):
+    """
+    The newest unread posts of the users' feeds created after their last digests (the first digest covers
+    the last window only) and whether there are more of them, by the users' ids. The whole batch is read
+    with one query for the posts' ids and one for the posts.
+    """
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    sql = DIGEST_POSTS_SQL.format(user_ids=placeholders, entry=FeedEntry._meta.db_table,
+                                  subscription=Subscription._meta.db_table, topic=Topic._meta.db_table,
+                                  post=Post._meta.db_table, digest=FeedDigest._meta.db_table,
+                                  read_post=ReadPost._meta.db_table)
+    params = [*user_ids, *user_ids, True, connection.ops.adapt_datetimefield_value(now - DIGEST_INTERVAL),
+              DIGEST_POSTS + 1]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    posts = Post.objects.select_related('topic', 'author').in_bulk({post_id for _, post_id in rows})
+    users_posts = {}
+    for user_id, post_id in rows:
+        if post_id in posts:
+            users_posts.setdefault(user_id, []).append(posts[post_id])
+
+    digests = {}
+    for user_id, user_posts in users_posts.items():
+        user_posts.sort(key=lambda post: (post.creation_date, post.pk), reverse=True)
+        digests[user_id] = (user_posts[:DIGEST_POSTS], len(user_posts) > DIGEST_POSTS)
+    return digests
+
+
+def render_digest(user, posts, has_more, mail_connection):
+    context = {'user': user, 'posts': posts, 'has_more': has_more, 'domain': 'localhost:8000'}
+    message = EmailMultiAlternatives(subject="New posts in your forum feed",
+                                     body=render_to_string('feed/digest_email.txt', context),
+                                     from_email=settings.DEFAULT_FROM_EMAIL, to=[user.email],
+                                     connection=mail_connection)
+    message.attach_alternative(render_to_string('feed/digest_email.html', context), 'text/html')
+    return message
+
+
+def mark_sent(user_ids, now):
+    FeedDigest.objects.bulk_create([FeedDigest(user_id=user_id, last_sent_at=now) for user_id in user_ids],
+                                   ignore_conflicts=True)
+    FeedDigest.objects.filter(user_id__in=user_ids).update(last_sent_at=now)
+
+
+def send_digests(batch_size=DIGEST_BATCH_SIZE):
+    """
+    Send the digests of the users who are due, in batches along the users' ids. The digests are sent one
+    at a time and those which went out are marked as sent even when a later one fails, so a failed run
+    is resumed without sending anybody a digest twice (unless the process itself dies in between).
+    Return the amount of sent digests.
+    """
+    now = timezone.now()
+    users = due_users(now).order_by('pk')
+    sent = 0
+    last_pk = 0
+
+    with get_connection() as mail_connection:
+        while True:
+            chunk = list(users.filter(pk__gt=last_pk)[:batch_size])
+            if not chunk:
+                return sent
+
+            digests = digest_posts([user.pk for user in chunk], now)
+            user_ids = []
+            try:
+                for user in chunk:
+                    if user.pk in digests:
+                        mail_connection.send_messages([render_digest(user, *digests[user.pk], mail_connection)])
+                        user_ids.append(user.pk)
+            finally:
+                if user_ids:
+                    mark_sent(user_ids, now)
+
+            sent += len(user_ids)
+            last_pk = chunk[-1].pk
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from feed.models import Subscription
+from feed.tasks import backfill_feed
+
+
+class Command(BaseCommand):
+    help = "Fill the feed entries of all subscriptions from the posts created after them"
+
+    def handle(self, *args, **options):
+        subscription_ids = Subscription.objects.order_by('pk').values_list('pk', flat=True)
+        for subscription_id in subscription_ids.iterator():
+            backfill_feed(subscription_id)
+
+        self.stdout.write(self.style.SUCCESS(f"Filled feed entries of {subscription_ids.count()} subscriptions"))
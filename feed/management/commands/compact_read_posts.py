@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from feed.models import Subscription, ReadPost
+from feed.read_marks import compact_read_posts
+
+
+class Command(BaseCommand):
+    help = "Move the read positions of subscriptions over the posts read out of order and remove their ReadPost rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--initialize', action='store_true',
+                            help="Store the subscriptions' creation dates as the read positions which weren't moved yet")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Amount of read posts of unsubscribed topics removed per transaction")
+
+    def handle(self, *args, **options):
+        if options['initialize']:
+            Subscription.objects.filter(last_read_date__isnull=True).update(last_read_date=F('creation_date'))
+
+        # rows of the topics the users aren't subscribed to are never read, they are removed in chunks
+        # along the primary keys, a transaction each, so the locks are held briefly
+        subscribed = Subscription.objects.filter(user=OuterRef('user'), topic=OuterRef('post__topic'))
+        orphaned_posts = ReadPost.objects.filter(~Exists(subscribed)).order_by('pk').values_list('pk', flat=True)
+        orphaned = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                chunk = list(orphaned_posts.filter(pk__gt=last_pk)[:options['batch_size']])
+                if not chunk:
+                    break
+                ReadPost.objects.filter(pk__in=chunk).delete()
+            orphaned += len(chunk)
+            last_pk = chunk[-1]
+
+        read_posts = ReadPost.objects.filter(user=OuterRef('user'), post__topic=OuterRef('topic'))
+        subscriptions = Subscription.objects.filter(Exists(read_posts)).order_by('pk')
+        compacted = 0
+        for subscription in subscriptions.iterator():
+            compacted += compact_read_posts(subscription)
+
+        self.stdout.write(self.style.SUCCESS(f"Removed {compacted + orphaned} read posts"))
@@ -6,11 +6,65 @@ class Subscription(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="user_subscription")
     topic = models.ForeignKey('discussions.Topic', on_delete=models.CASCADE, related_name="topic_subscription")
     creation_date = models.DateTimeField(auto_now_add=True, null=True)
+    # the user's read position in the topic, the posts created up to it are read,
+    # the posts read out of order after it are stored as ReadPost rows, see read_marks.py.
+    # NULL until the position is moved, the subscription's creation date is the position then
+    last_read_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # also the index the feed query joins posts' topics through, see FeedView
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'topic'], name='unique_user_topic_subscription'),
+        ]
+
+    @property
+    def read_position(self):
+        return self.last_read_date or self.creation_date
 
 
 class ReadPost(models.Model):
+    """
+    A post read after the read position of the user's subscription (see Subscription.last_read_date)
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     post = models.ForeignKey("discussions.Post", on_delete=models.CASCADE)
 
     def __str__(self):
         return str(self.user) + " - " + str(self.post.pk)
+
+    class Meta:
+        # also supports the read posts anti-join of the feed query
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_user_read_post'),
+        ]
+
+
+class FeedEntry(models.Model):
+    """
+    A post copied to the feed of a subscriber of its topic when the post is created, see tasks.py
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="feed_entries")
+    post = models.ForeignKey("discussions.Post", on_delete=models.CASCADE, related_name="+")
+    # denormalized from the post, so feed pages and purges don't need joins
+    topic = models.ForeignKey("discussions.Topic", on_delete=models.CASCADE, related_name="+")
+    creation_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_user_feed_post'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-creation_date', '-post']),
+            models.Index(fields=['user', 'topic']),
+        ]
+
+
+class FeedDigest(models.Model):
+    """
+    When the last digest email of the user's feed was sent, see digests.py
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="feed_digest")
+    last_sent_at = models.DateTimeField()
+
+    def __str__(self):
+        return str(self.user) + " - " + str(self.last_sent_at)
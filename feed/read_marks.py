@@ -0,0 +1,131 @@
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from discussions.models import Post
+from core.models import UnreadCounter
+from core.counters import change_unread_counter
+from .models import Subscription, ReadPost, FeedEntry
+
+
+def remove_entries(user_id, entries):
+    """Delete the user's feed entries and decrease the user's unread counter accordingly"""
+    deleted, _ = entries.delete()
+    change_unread_counter(UnreadCounter.FEED_POSTS, [user_id], -deleted)
+
+
+def read_position(prefix=''):
+    """The read position of subscriptions (see Subscription.read_position) as an expression"""
+    return Coalesce(f'{prefix}last_read_date', f'{prefix}creation_date')
+
+
+def unread_posts(subscription):
+    """Posts of the subscribed topic after the read position, which aren't read out of order"""
+    if subscription.read_position is None:
+        return Post.objects.none()
+
+    read_posts = ReadPost.objects.filter(user_id=subscription.user_id, post=OuterRef('pk'))
+    return Post.objects.filter(topic_id=subscription.topic_id, creation_date__gt=subscription.read_position) \
+        .exclude(author_id=subscription.user_id) \
+        .filter(~Exists(read_posts))
+
+
+def unread_entries(user):
+    """The user's feed entries which aren't read out of order"""
+    read_posts = ReadPost.objects.filter(user=user, post=OuterRef('post_id'))
+    return FeedEntry.objects.filter(user=user).filter(~Exists(read_posts))
+
+
+def unread_pulled_posts(user):
+    """
+    Posts of the user's subscribed pull topics after the read positions, as one query:
+    a join with the subscriptions (both conditions in one filter() share the join)
+    and a NOT EXISTS anti-join with the posts read out of order
+    """
+    read_posts = ReadPost.objects.filter(user=user, post=OuterRef('pk'))
+    return Post.objects.filter(topic__topic_subscription__user=user, topic__feed_pull=True,
+                               creation_date__gt=read_position('topic__topic_subscription__')) \
+        .exclude(author=user) \
+        .filter(~Exists(read_posts))
+
+
+@transaction.atomic
+def mark_read(user, post):
+    """
+    Mark a single post as read. Return False if it was read already.
+    """
+    subscription = Subscription.objects.filter(user=user, topic_id=post.topic_id).first()
+    if subscription is not None and subscription.read_position is not None \
+            and post.creation_date <= subscription.read_position:
+        return False
+
+    if ReadPost.objects.filter(user=user, post=post).exists():
+        return False
+
+    ReadPost.objects.create(user=user, post=post)
+    remove_entries(user.pk, FeedEntry.objects.filter(user=user, post=post))
+    return True
+
+
+@transaction.atomic
+def mark_posts_read(user, post_ids):
+    """
+    Mark the posts as read with a single INSERT of those which are after the read positions
+    (the posts read already are skipped by the unique constraint)
+    """
+    unread_ids = Post.objects.filter(pk__in=post_ids, topic__topic_subscription__user=user,
+                                     creation_date__gt=read_position('topic__topic_subscription__')) \
+        .values_list('pk', flat=True)
+    ReadPost.objects.bulk_create([ReadPost(user=user, post_id=pk) for pk in unread_ids], ignore_conflicts=True)
+    remove_entries(user.pk, FeedEntry.objects.filter(user=user, post_id__in=post_ids))
+
+
+@transaction.atomic
+def mark_topic_read(user, topic_id):
+    """Move the read position of the user's subscription of the topic to now"""
+    Subscription.objects.filter(user=user, topic_id=topic_id).update(last_read_date=timezone.now())
+    ReadPost.objects.filter(user=user, post__topic_id=topic_id).delete()
+    remove_entries(user.pk, FeedEntry.objects.filter(user=user, topic_id=topic_id))
+
+
+@transaction.atomic
+def mark_read_up_to(user, date):
+    """
+    Move the read position of all the user's subscriptions to `date` (the positions ahead of it are kept),
+    the out of order read posts and feed entries behind the new positions aren't needed anymore
+    """
+    Subscription.objects.filter(user=user).annotate(position=read_position()) \
+        .filter(Q(position__lt=date) | Q(position__isnull=True)).update(last_read_date=date)
+    ReadPost.objects.filter(user=user, post__creation_date__lte=date).delete()
+    remove_entries(user.pk, FeedEntry.objects.filter(user=user, creation_date__lte=date))
+
+
+@transaction.atomic
+def compact_read_posts(subscription):
+    """
+    Move the subscription's read position over the posts which are read out of order, up to the first
+    unread post, and drop their ReadPost rows. Return the amount of removed rows.
+    """
+    subscription = Subscription.objects.select_for_update().get(pk=subscription.pk)
+    if subscription.read_position is None:
+        return 0
+
+    first_unread_date = unread_posts(subscription).order_by('creation_date').values_list('creation_date', flat=True) \
+        .first()
+
+    posts = Post.objects.filter(topic_id=subscription.topic_id, creation_date__gt=subscription.read_position)
+    if first_unread_date is not None:
+        posts = posts.filter(creation_date__lt=first_unread_date)
+    read_up_to = posts.aggregate(last_read_date=Max('creation_date'))['last_read_date']
+    if read_up_to is None:
+        return 0
+
+    subscription.last_read_date = read_up_to
+    subscription.save(update_fields=['last_read_date'])
+    remove_entries(subscription.user_id, FeedEntry.objects.filter(user_id=subscription.user_id,
+                                                                  topic_id=subscription.topic_id,
+                                                                  creation_date__lte=read_up_to))
+    deleted, _ = ReadPost.objects.filter(user_id=subscription.user_id, post__topic_id=subscription.topic_id,
+                                         post__creation_date__lte=read_up_to).delete()
+    return deleted
@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from discussions.models import Post
+from core.models import UnreadCounter
+from core.counters import change_unread_counter
+from .models import FeedEntry
+from .tasks import fan_out_post, publish_post_event
+
+
+# copy new posts to the feeds of the topic's subscribers, after the post is committed
+@receiver(post_save, sender=Post)
+def fan_out_post_when_post_add(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: fan_out_post.delay(instance.pk))
+
+
+# send new posts to the open feed streams of the topic's subscribers, in the background
+# so an unavailable broker doesn't fail the request which has committed the post
+@receiver(post_save, sender=Post)
+def publish_post_when_post_add(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: publish_post_event.delay(instance.pk))
+
+
+# the feed entries of a deleted post (also of a deleted topic) are removed by the cascade,
+# so the post is taken off the unread counters of their users in the same transaction
+@receiver(pre_delete, sender=Post)
+def update_feed_counters_when_post_delete(sender, instance, **kwargs):
+    user_ids = list(FeedEntry.objects.filter(post=instance).values_list('user_id', flat=True))
+    change_unread_counter(UnreadCounter.FEED_POSTS, user_ids, -1)
@@ -0,0 +1,215 @@
+"""
+Server-Sent Events stream of the new posts of the user's subscribed topics.
+
+Django 3.0 has no async views, so the stream is a plain ASGI application mounted next to Django
+in forum/asgi.py. An idle stream is a coroutine waiting on its queue, so a single worker can hold
+thousands of them. Events come from the broker (see broker.py), the database is only used when
+a stream is opened or resumed and when the user's subscriptions change.
+"""
+import asyncio
+import json
+from http.cookies import SimpleCookie
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.http import HttpRequest
+from django.urls import reverse
+
+from discussions.models import Post
+from .broker import get_broker
+from .models import Subscription
+from .read_marks import read_position
+
+STREAM_PATH = '/feed/stream/'
+
+# a comment line is sent after this many seconds without events, so proxies keep the connection open
+HEARTBEAT_INTERVAL = 15
+
+# events waiting to be sent to a slow client, when the queue is full the stream is closed
+# and the client resumes from its Last-Event-ID
+STREAM_QUEUE_SIZE = 100
+
+# amount of missed posts sent when a stream is resumed
+RESUME_LIMIT = 100
+
+# EventSource clients wait this many milliseconds before reconnecting
+RETRY_INTERVAL = 3000
+
+
+def post_event(post):
+    """The event of a new post, the stream sends its id and data as they are"""
+    return {
+        'type': 'post',
+        'id': post.pk,
+        'topic_id': post.topic_id,
+        'author_id': post.author_id,
+        'data': {
+            'post_id': post.pk,
+            'topic_title': post.topic.topic_title,
+            'author': post.author.username if post.author else None,
+            'creation_date': post.creation_date.isoformat(),
+            'post_body': post.post_body[:300],
+            'url': reverse('discussions:topic', kwargs={'topic_id': post.topic_id}) + f'#{post.pk}',
+        },
+    }
+
+
+def subscription_event(user_id):
+    """The event telling the user's streams to reload the subscribed topics"""
+    return {'type': 'subscription', 'user_id': user_id}
+
+
+def publish_post(post_id):
+    post = Post.objects.select_related('topic', 'author').filter(pk=post_id).first()
+    if post is not None:
+        get_broker().publish(post_event(post))
+
+
+def get_scope_user(scope):
+    """The user of the session cookie of the ASGI connection"""
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+
+    request = HttpRequest()
+    session_cookie = cookies.get(settings.SESSION_COOKIE_NAME)
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+        session_cookie.value if session_cookie else None)
+    return get_user(request)
+
+
+def subscribed_topic_ids(user_id):
+    return set(Subscription.objects.filter(user_id=user_id).values_list('topic_id', flat=True))
+
+
+def missed_post_events(user_id, last_event_id):
+    """Events of the posts of the subscribed topics created after the one with `last_event_id`"""
+    posts = Post.objects.filter(pk__gt=last_event_id, topic__topic_subscription__user_id=user_id,
+                                creation_date__gt=read_position('topic__topic_subscription__')) \
+        .exclude(author_id=user_id).select_related('topic', 'author').order_by('pk')[:RESUME_LIMIT]
+    return [post_event(post) for post in posts]
+
+
+def encode_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n".encode()
+
+
+class FeedStream:
+    """
+    A single SSE connection. Events are put into a bounded queue by the broker callback,
+    so a slow client can't make the worker buffer an unlimited amount of data.
+    """
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.overflowed = False
+        self.user_id = None
+        self.topic_ids = set()
+        self.resumed_post_ids = set()
+
+    def on_event(self, event):
+        if event['type'] == 'post':
+            if event['topic_id'] not in self.topic_ids or event['author_id'] == self.user_id:
+                return
+        elif event['user_id'] != self.user_id:
+            return
+
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def get_last_event_id(self):
+        for name, value in self.scope.get('headers', []):
+            if name == b'last-event-id':
+                try:
+                    return int(value)
+                except ValueError:
+                    return 0
+        return 0
+
+    async def send_body(self, body, more_body=True):
+        await self.send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+
+    async def run(self):
+        user = await sync_to_async(get_scope_user, thread_sensitive=True)(self.scope)
+        if not user.is_authenticated:
+            await self.send({'type': 'http.response.start', 'status': 403,
+                             'headers': [(b'content-type', b'text/plain')]})
+            await self.send_body(b'Forbidden', more_body=False)
+            return
+
+        self.user_id = user.pk
+        # subscribed before the topics are loaded, so no post falls in between
+        unsubscribe = get_broker().subscribe(asyncio.get_event_loop(), self.on_event)
+        disconnect = asyncio.ensure_future(self.wait_for_disconnect())
+        try:
+            self.topic_ids = await sync_to_async(subscribed_topic_ids, thread_sensitive=True)(self.user_id)
+            await self.send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await self.send_body(f'retry: {RETRY_INTERVAL}\n\n'.encode())
+
+            last_event_id = self.get_last_event_id()
+            if last_event_id:
+                for event in await sync_to_async(missed_post_events, thread_sensitive=True)(self.user_id,
+                                                                                             last_event_id):
+                    self.resumed_post_ids.add(event['id'])
+                    await self.send_body(encode_event(event))
+
+            await self.stream(disconnect)
+        finally:
+            unsubscribe()
+            disconnect.cancel()
+
+    async def wait_for_disconnect(self):
+        while (await self.receive())['type'] != 'http.disconnect':
+            pass
+
+    async def stream(self, disconnect):
+        while not self.overflowed:
+            event = asyncio.ensure_future(self.queue.get())
+            done, _ = await asyncio.wait({event, disconnect}, timeout=HEARTBEAT_INTERVAL,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                event.cancel()
+                return
+
+            if event in done:
+                await self.handle_event(event.result())
+            else:
+                event.cancel()
+                await self.send_body(b': heartbeat\n\n')
+
+        # the client reconnects and resumes from the last event it got
+        await self.send_body(b'', more_body=False)
+
+    async def handle_event(self, event):
+        if event['type'] == 'subscription':
+            self.topic_ids = await sync_to_async(subscribed_topic_ids, thread_sensitive=True)(self.user_id)
+        # the posts sent on resumption can come once more from the broker
+        elif event['id'] not in self.resumed_post_ids:
+            await self.send_body(encode_event(event))
+
+
+class FeedStreamRouter:
+    """
+    ASGI application serving the feed stream itself and passing all the other requests to Django
+    """
+
+    def __init__(self, django_application):
+        self.django_application = django_application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == STREAM_PATH:
+            await FeedStream(scope, receive, send).run()
+        else:
+            await self.django_application(scope, receive, send)
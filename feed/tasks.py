@@ -0,0 +1,135 @@
+from django.db import connection, transaction
+
+from discussions.models import Topic, Post
+from core.models import UnreadCounter
+from core.counters import change_unread_counter
+from .models import Subscription, FeedEntry
+from .read_marks import read_position, remove_entries
+from .broker import get_broker
+from .streaming import publish_post, subscription_event
+from . import digests
+
+from forum.celery import app
+
+# subscriptions read and entries inserted per statement
+FANOUT_BATCH_SIZE = 1000
+
+# posts of topics with more subscribers than this are read from the topics when the feed is shown
+# instead of being copied to every subscriber's feed, see FeedView
+FANOUT_MAX_SUBSCRIBERS = 5000
+
+
+def insert_entries(entries):
+    """
+    Insert the feed entries with a single statement, skipping those the users already have
+    (a retried task or a concurrent backfill could have added them). Return the users' ids
+    of the inserted entries, so only those are added to the unread counters.
+    """
+    if not entries:
+        return []
+
+    quote_name = connection.ops.quote_name
+    fields = [FeedEntry._meta.get_field(name) for name in ('user', 'post', 'topic', 'creation_date')]
+    user_column, post_column = quote_name(fields[0].column), quote_name(fields[1].column)
+    columns = ', '.join(quote_name(field.column) for field in fields)
+    rows = ', '.join(['(%s)' % ', '.join(['%s'] * len(fields))] * len(entries))
+    params = [field.get_db_prep_save(getattr(entry, field.attname), connection) for entry in entries for field in fields]
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {quote_name(FeedEntry._meta.db_table)} ({columns}) VALUES {rows} '
+                       f'ON CONFLICT ({user_column}, {post_column}) DO NOTHING RETURNING {user_column}', params)
+        return [user_id for user_id, in cursor.fetchall()]
+
+
+def fan_out(post, subscriptions):
+    """Insert the post into the feeds of the `subscriptions` users, in chunks along the subscriptions' ids"""
+    subscriptions = subscriptions.annotate(position=read_position()).filter(position__lt=post.creation_date) \
+        .exclude(user_id=post.author_id)
+    last_pk = 0
+
+    while True:
+        chunk = list(subscriptions.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'user_id')[:FANOUT_BATCH_SIZE])
+        if not chunk:
+            return
+
+        user_ids = insert_entries([FeedEntry(user_id=user_id, post_id=post.pk, topic_id=post.topic_id,
+                                             creation_date=post.creation_date) for _, user_id in chunk])
+        change_unread_counter(UnreadCounter.FEED_POSTS, user_ids, 1)
+        last_pk = chunk[-1][0]
+
+
+@app.task
+def fan_out_post(post_id):
+    post = Post.objects.filter(pk=post_id).only('topic_id', 'author_id', 'creation_date').first()
+    if post is None:
+        return
+
+    subscriptions = Subscription.objects.filter(topic_id=post.topic_id)
+    if Topic.objects.filter(pk=post.topic_id, feed_pull=True).exists():
+        return
+
+    # reads at most FANOUT_MAX_SUBSCRIBERS + 1 index entries instead of counting all of them
+    if subscriptions[FANOUT_MAX_SUBSCRIBERS:FANOUT_MAX_SUBSCRIBERS + 1].exists():
+        # the topic never goes back, so none of its posts can be missing from both the entries and the pull
+        Topic.objects.filter(pk=post.topic_id).update(feed_pull=True)
+        return
+
+    fan_out(post, subscriptions)
+
+
+@app.task
+def backfill_feed(subscription_id):
+    """
+    Add the posts created after the subscription's read position to the user's feed. For new subscriptions
+    these are the posts which were fanned out before the subscription was committed.
+    """
+    subscription = Subscription.objects.filter(pk=subscription_id).select_related('topic').first()
+    if subscription is None or subscription.topic.feed_pull or subscription.read_position is None:
+        return
+
+    posts = Post.objects.filter(topic_id=subscription.topic_id, creation_date__gt=subscription.read_position) \
+        .exclude(author_id=subscription.user_id)
+    last_pk = 0
+
+    # the posts are read in chunks along their ids, so a long topic history is never held in memory at once
+    while True:
+        chunk = list(posts.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'creation_date')[:FANOUT_BATCH_SIZE])
+        if not chunk:
+            return
+
+        user_ids = insert_entries([FeedEntry(user_id=subscription.user_id, post_id=pk, topic_id=subscription.topic_id,
+                                             creation_date=creation_date) for pk, creation_date in chunk])
+        change_unread_counter(UnreadCounter.FEED_POSTS, [subscription.user_id], len(user_ids))
+        last_pk = chunk[-1][0]
+
+
+@app.task
+def purge_feed(user_id, topic_id):
+    """Remove the topic's posts from the user's feed, in chunks so the locks are held briefly"""
+    if Subscription.objects.filter(user_id=user_id, topic_id=topic_id).exists():
+        # the user has subscribed again before the task ran
+        return
+
+    entries = FeedEntry.objects.filter(user_id=user_id, topic_id=topic_id)
+    while True:
+        with transaction.atomic():
+            chunk = list(entries.values_list('pk', flat=True)[:FANOUT_BATCH_SIZE])
+            if not chunk:
+                return
+            remove_entries(user_id, FeedEntry.objects.filter(pk__in=chunk))
+
+
+@app.task
+def publish_post_event(post_id):
+    """Send the new post to the open feed streams, outside of the request which created it"""
+    publish_post(post_id)
+
+
+@app.task
+def publish_subscription_event(user_id):
+    get_broker().publish(subscription_event(user_id))
+
+
+@app.task
+def send_feed_digests():
+    return digests.send_digests()
@@ -1,3 +1,384 @@
+import datetime
+import json
+import mock
+from io import StringIO
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from discussions.models import Category, Topic, Post
+from .models import Subscription, ReadPost, FeedEntry, FeedDigest
+from .tasks import fan_out_post, backfill_feed, purge_feed, send_feed_digests
+from .views import FeedView
+from .digests import DIGEST_POSTS
+from .read_marks import mark_read
+from .broker import RedisBroker, get_broker
+from .streaming import STREAM_PATH, FeedStreamRouter, post_event
+
+
+class FeedViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name="Test Category")
+        cls.reader = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+        cls.writer = User.objects.create_user(username='writer', password='2HJ1vRV0Z&3iD')
+
+        for topic_id in range(3):
+            topic = Topic.objects.create(topic_title=f"Topic {topic_id}", category=category)
+            Post.objects.create(topic=topic, post_body=f"Old post {topic_id}", author=cls.writer)
+            # the topic of the last iteration isn't followed by the reader
+            if topic_id < 2:
+                subscription = Subscription.objects.create(user=cls.reader, topic=topic)
+                day_ago = timezone.now() - datetime.timedelta(days=1)
+                Subscription.objects.filter(pk=subscription.pk).update(creation_date=day_ago, last_read_date=day_ago)
+                Post.objects.filter(topic=topic).update(creation_date=timezone.now() - datetime.timedelta(days=2))
+            for i in range(15):
+                Post.objects.create(topic=topic, post_body=f"Post {topic_id}-{i}", author=cls.writer)
+            Post.objects.create(topic=topic, post_body=f"Own post {topic_id}", author=cls.reader)
+
+        # the fan-out tasks run after commits, which don't happen in TestCase
+        for subscription in Subscription.objects.all():
+            backfill_feed(subscription.pk)
+
+    def setUp(self):
+        self.client.login(username='reader', password='1X<ISRUkw+tuK')
+
+    def test_feed_shows_new_unread_posts_of_subscribed_topics(self):
+        ReadPost.objects.create(user=self.reader, post=Post.objects.get(post_body="Post 0-3"))
+
+        # session, user with profile, feed entries, pulled posts, user's unread counters
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('feed:feed'))
+        posts = list(response.context['posts_list'])
+        page = response.context['page_obj']
+        while page.has_next():
+            response = self.client.get(reverse('feed:feed') + '?' + page.next_querystring)
+            posts.extend(response.context['posts_list'])
+            page = response.context['page_obj']
+
+        bodies = {post.post_body for post in posts}
+        self.assertEqual(len(posts), 29)
+        self.assertEqual(len(bodies), 29)
+        self.assertNotIn("Post 0-3", bodies)
+        self.assertFalse(any(body.startswith(("Old post", "Own post", "Post 2-")) for body in bodies))
+
+        dates = [post.creation_date for post in posts]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_mark_read_up_to_moves_read_positions(self):
+        post = Post.objects.get(post_body="Post 1-9")
+        ReadPost.objects.create(user=self.reader, post=Post.objects.get(post_body="Post 0-3"))
+
+        response = self.client.get(reverse('feed:mark_read_up_to', kwargs={'post_id': post.pk}))
+        self.assertRedirects(response, reverse('feed:feed'))
+
+        self.assertFalse(ReadPost.objects.filter(user=self.reader).exists())
+        response = self.client.get(reverse('feed:feed'))
+        self.assertEqual({post.post_body for post in response.context['posts_list']},
+                         {f"Post 1-{i}" for i in range(10, 15)})
+
+        response = self.client.get(reverse('feed:mark_read', kwargs={'post_id': post.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_subscriptions_without_read_position_are_read_from_their_creation(self):
+        Subscription.objects.update(last_read_date=None)
+        # the posts of the topic are pulled, the read position is compared in the feed query
+        topic = Topic.objects.get(topic_title="Topic 0")
+        Topic.objects.filter(pk=topic.pk).update(feed_pull=True)
+        FeedEntry.objects.filter(topic=topic).delete()
+
+        response = self.client.get(reverse('feed:feed'))
+        self.assertEqual(len(response.context['posts_list']), FeedView.paginate_by)
+        self.assertIn("Post 0-14", {post.post_body for post in response.context['posts_list']})
+        self.assertTrue(mark_read(self.reader, Post.objects.get(post_body="Post 0-14")))
+        self.assertFalse(mark_read(self.reader, Post.objects.get(post_body="Old post 0")))
+
+        self.client.get(reverse('feed:mark_read_up_to', kwargs={'post_id': Post.objects.get(post_body="Post 0-9").pk}))
+        self.assertEqual(Subscription.objects.get(topic=topic).last_read_date,
+                         Post.objects.get(post_body="Post 0-9").creation_date)
+
+    def test_compact_read_posts_command(self):
+        topic_posts = list(Post.objects.filter(topic__topic_title="Topic 0", post_body__startswith="Post")
+                           .order_by('creation_date'))
+        for post in topic_posts[:5] + topic_posts[6:8]:
+            ReadPost.objects.create(user=self.reader, post=post)
+        # the reader isn't subscribed to the topic
+        ReadPost.objects.create(user=self.reader, post=Post.objects.get(post_body="Post 2-0"))
+
+        out = StringIO()
+        call_command('compact_read_posts', batch_size=1, stdout=out)
+
+        subscription = Subscription.objects.get(user=self.reader, topic=topic_posts[0].topic)
+        self.assertEqual(subscription.last_read_date, topic_posts[4].creation_date)
+        self.assertEqual(set(ReadPost.objects.values_list('post', flat=True)), {post.pk for post in topic_posts[6:8]})
+        self.assertIn("Removed 6 read posts", out.getvalue())
+
+    def test_mark_posts_read_endpoint(self):
+        posts = Post.objects.filter(post_body__in=["Post 0-1", "Post 1-2", "Post 2-3"])
+        post_ids = [str(post.pk) for post in posts]
+
+        response = self.client.post(reverse('feed:mark_posts_read'), {'post_ids': post_ids})
+        self.assertEqual(response.status_code, 404)
+
+        for _ in range(2):
+            response = self.client.post(reverse('feed:mark_posts_read'), {'post_ids': post_ids},
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual(response.status_code, 200)
+
+        # the post of the topic the reader isn't subscribed to is skipped
+        self.assertEqual(set(ReadPost.objects.values_list('post__post_body', flat=True)), {"Post 0-1", "Post 1-2"})
+
+        response = self.client.post(reverse('feed:mark_posts_read'), {'post_ids': ['x']},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+
+    def test_mark_all_read(self):
+        topic = Topic.objects.get(topic_title="Topic 0")
+        ReadPost.objects.create(user=self.reader, post=Post.objects.get(post_body="Post 0-3"))
+
+        response = self.client.get(reverse('feed:mark_topic_read', kwargs={'topic_id': topic.pk}))
+        self.assertRedirects(response, reverse('discussions:topic', kwargs={'topic_id': topic.pk}))
+        self.assertFalse(ReadPost.objects.exists())
+        response = self.client.get(reverse('feed:feed'))
+        self.assertEqual({post.topic for post in response.context['posts_list']}, {Topic.objects.get(topic_title="Topic 1")})
+
+        self.client.get(reverse('feed:mark_all_read'))
+        response = self.client.get(reverse('feed:feed'))
+        self.assertEqual(list(response.context['posts_list']), [])
+
+    def test_unsubscribing_deletes_read_posts(self):
+        topic = Topic.objects.get(topic_title="Topic 0")
+        ReadPost.objects.bulk_create([ReadPost(user=self.reader, post=post) for post in topic.posts.all()])
+
+        response = self.client.get(reverse('feed:subscription', kwargs={'topic_id': topic.pk}),
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['message'], 'Subscription removed')
+        self.assertFalse(ReadPost.objects.exists())
+
+    def test_feed_is_paginated(self):
+        response = self.client.get(reverse('feed:feed'))
+        first_page = list(response.context['posts_list'])
+        self.assertEqual(len(first_page), FeedView.paginate_by)
+        self.assertTrue(response.context['page_obj'].has_next())
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+        response = self.client.get(reverse('feed:feed') + '?' + response.context['page_obj'].next_querystring)
+        self.assertTrue(response.context['page_obj'].has_previous())
+
+        response = self.client.get(reverse('feed:feed') + '?' + response.context['page_obj'].previous_querystring)
+        self.assertEqual(list(response.context['posts_list']), first_page)
+        self.assertFalse(response.context['page_obj'].has_previous())
+        self.assertTrue(response.context['page_obj'].has_next())
+
+
+class FeedFanOutTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(category_name="Test Category")
+        self.reader = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+        self.writer = User.objects.create_user(username='writer', password='2HJ1vRV0Z&3iD')
+        self.topic = Topic.objects.create(topic_title="Topic", category=category)
+        Subscription.objects.create(user=self.reader, topic=self.topic)
+        Subscription.objects.create(user=self.writer, topic=self.topic)
+
+    def test_new_posts_are_fanned_out_to_subscribers_except_author(self):
+        post = Post.objects.create(topic=self.topic, post_body="Post", author=self.writer)
+        fan_out_post(post.pk)
+        # the task can run more than once
+        fan_out_post(post.pk)
+
+        self.assertEqual(list(FeedEntry.objects.values_list('user', 'post')), [(self.reader.pk, post.pk)])
+
+    def test_posts_of_topics_with_many_subscribers_are_pulled(self):
+        post = Post.objects.create(topic=self.topic, post_body="Post of a crowded topic", author=self.writer)
+        with mock.patch('feed.tasks.FANOUT_MAX_SUBSCRIBERS', 1):
+            fan_out_post(post.pk)
+
+        self.topic.refresh_from_db()
+        self.assertTrue(self.topic.feed_pull)
+        self.assertFalse(FeedEntry.objects.exists())
+
+        self.client.login(username='reader', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('feed:feed'))
+        self.assertEqual(list(response.context['posts_list']), [post])
+
+    def test_topics_with_subscribers_up_to_the_limit_are_fanned_out(self):
+        post = Post.objects.create(topic=self.topic, post_body="Post", author=self.writer)
+        with mock.patch('feed.tasks.FANOUT_MAX_SUBSCRIBERS', 2):
+            fan_out_post(post.pk)
+
+        self.topic.refresh_from_db()
+        self.assertFalse(self.topic.feed_pull)
+        self.assertTrue(FeedEntry.objects.filter(user=self.reader, post=post).exists())
+
+    def test_backfill_reads_posts_in_chunks(self):
+        posts = [Post.objects.create(topic=self.topic, post_body=f"Post {i}", author=self.writer) for i in range(5)]
+        with mock.patch('feed.tasks.FANOUT_BATCH_SIZE', 2):
+            backfill_feed(Subscription.objects.get(user=self.reader).pk)
+
+        self.assertEqual(set(FeedEntry.objects.filter(user=self.reader).values_list('post', flat=True)),
+                         {post.pk for post in posts})
+
+    def test_unsubscribing_purges_feed(self):
+        post = Post.objects.create(topic=self.topic, post_body="Post", author=self.writer)
+        fan_out_post(post.pk)
+
+        purge_feed(self.reader.pk, self.topic.pk)
+        self.assertTrue(FeedEntry.objects.filter(user=self.reader).exists())
+
+        Subscription.objects.filter(user=self.reader).delete()
+        purge_feed(self.reader.pk, self.topic.pk)
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader).exists())
+
+
+class FeedStreamTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(category_name="Test Category")
+        self.reader = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+        self.writer = User.objects.create_user(username='writer', password='2HJ1vRV0Z&3iD')
+        self.topic = Topic.objects.create(topic_title="Topic", category=category)
+        self.other_topic = Topic.objects.create(topic_title="Other topic", category=category)
+        Subscription.objects.create(user=self.reader, topic=self.topic)
+        self.client.login(username='reader', password='1X<ISRUkw+tuK')
+
+    def get_scope(self, headers=()):
+        session_cookie = f'{settings.SESSION_COOKIE_NAME}={self.client.session.session_key}'.encode()
+        return {'type': 'http', 'method': 'GET', 'path': STREAM_PATH,
+                'headers': [(b'cookie', session_cookie), *headers]}
+
+    @async_to_sync
+    async def stream(self, scope, publish=(), expected_bodies=1):
+        """Open the stream, publish the events once it is ready and return the response start and bodies"""
+        communicator = ApplicationCommunicator(FeedStreamRouter(None), scope)
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output()
+        bodies = []
+        if start['status'] == 200:
+            # the retry interval comes when the stream is subscribed to the broker
+            await communicator.receive_output()
+            for event in publish:
+                get_broker().publish(event)
+            for _ in range(expected_bodies):
+                bodies.append((await communicator.receive_output())['body'])
+            await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait()
+        return start, bodies
+
+    def test_anonymous_users_are_forbidden(self):
+        self.client.logout()
+        start, _ = self.stream({'type': 'http', 'method': 'GET', 'path': STREAM_PATH, 'headers': []})
+        self.assertEqual(start['status'], 403)
+
+    def test_new_posts_of_subscribed_topics_are_streamed(self):
+        other_post = Post.objects.create(topic=self.other_topic, post_body="Other post", author=self.writer)
+        own_post = Post.objects.create(topic=self.topic, post_body="Own post", author=self.reader)
+        post = Post.objects.create(topic=self.topic, post_body="New post", author=self.writer)
+
+        start, bodies = self.stream(self.get_scope(), publish=[post_event(other_post), post_event(own_post),
+                                                               post_event(post)])
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertTrue(bodies[0].startswith(f'id: {post.pk}\nevent: post\n'.encode()))
+        self.assertIn(b'New post', bodies[0])
+
+    @mock.patch('feed.streaming.HEARTBEAT_INTERVAL', 0.05)
+    def test_missed_posts_are_sent_on_resume(self):
+        first_post = Post.objects.create(topic=self.topic, post_body="First post", author=self.writer)
+        Post.objects.create(topic=self.topic, post_body="Second post", author=self.writer)
+        third_post = Post.objects.create(topic=self.topic, post_body="Third post", author=self.writer)
+
+        # the resumed post comes from the broker as well, but it is sent once
+        _, bodies = self.stream(self.get_scope([(b'last-event-id', str(first_post.pk).encode())]),
+                                publish=[post_event(third_post)], expected_bodies=3)
+        self.assertIn(b'Second post', bodies[0])
+        self.assertIn(b'Third post', bodies[1])
+        self.assertEqual(bodies[2], b': heartbeat\n\n')
+
+    @mock.patch('feed.streaming.HEARTBEAT_INTERVAL', 0.01)
+    def test_heartbeats_are_sent_to_idle_streams(self):
+        _, bodies = self.stream(self.get_scope(), expected_bodies=2)
+        self.assertEqual(bodies, [b': heartbeat\n\n', b': heartbeat\n\n'])
+
+    @mock.patch('feed.streaming.STREAM_QUEUE_SIZE', 1)
+    def test_stream_of_slow_client_is_closed(self):
+        posts = [Post.objects.create(topic=self.topic, post_body=f"Post {i}", author=self.writer) for i in range(3)]
+        _, bodies = self.stream(self.get_scope(), publish=[post_event(post) for post in posts], expected_bodies=2)
+        self.assertIn(b'Post 0', bodies[0])
+        self.assertEqual(bodies[1], b'')
+
+
+    def test_broken_events_dont_stop_the_redis_listener(self):
+        broker = RedisBroker('redis://localhost:6379/0')
+        event = {'type': 'subscription', 'user_id': self.reader.pk}
+        with mock.patch.object(broker, 'deliver') as deliver, self.assertLogs(level='ERROR'):
+            broker.handle_message({'data': b'not json'})
+            broker.handle_message({'data': json.dumps(event).encode()})
+        deliver.assert_called_once_with(event)
+
+
+class FeedDigestTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(category_name="Test Category")
+        self.writer = User.objects.create_user(username='writer', password='2HJ1vRV0Z&3iD', email='writer@test.com')
+        self.topic = Topic.objects.create(topic_title="Topic", category=category)
+        self.readers = [User.objects.create_user(username=f'reader{i}', password='1X<ISRUkw+tuK',
+                                                 email=f'reader{i}@test.com') for i in range(3)]
+        for reader in self.readers:
+            Subscription.objects.create(user=reader, topic=self.topic)
+        self.post = Post.objects.create(topic=self.topic, post_body="Post for the digest", author=self.writer)
+        fan_out_post(self.post.pk)
+        # the verification emails of the new users
+        mail.outbox = []
+
+    def test_digests_are_sent_in_batches_over_one_connection(self):
+        ReadPost.objects.create(user=self.readers[2], post=self.post)
+
+        with mock.patch('feed.digests.DIGEST_BATCH_SIZE', 1), \
+                mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+            self.assertEqual(send_feed_digests(), 2)
+        open_connection.assert_called_once()
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['reader0@test.com', 'reader1@test.com'])
+        self.assertIn("Post for the digest", mail.outbox[0].body)
+        self.assertIn("Post for the digest", mail.outbox[0].alternatives[0][0])
+        self.assertEqual(FeedDigest.objects.count(), 2)
+
+    def test_digests_of_a_batch_are_read_with_constant_queries(self):
+        pull_topic = Topic.objects.create(topic_title="Pull topic", category=self.topic.category, feed_pull=True)
+        for reader in self.readers:
+            Subscription.objects.create(user=reader, topic=pull_topic)
+        Subscription.objects.update(last_read_date=timezone.now() - datetime.timedelta(hours=1))
+        for i in range(DIGEST_POSTS + 1):
+            Post.objects.create(topic=pull_topic, post_body=f"Pulled post {i}", author=self.writer)
+
+        # due users, posts' ids of the batch, posts with topics and authors, INSERT and UPDATE of the marks
+        # of the sent digests, the check for the next batch
+        with self.assertNumQueries(6):
+            self.assertEqual(send_feed_digests(), 3)
+        self.assertIn("Pulled post 10", mail.outbox[0].body)
+        self.assertNotIn("Post for the digest", mail.outbox[0].body)
+        self.assertIn("There are more new posts in your feed", mail.outbox[0].body)
+
+    def test_sent_digests_are_marked_when_sending_fails(self):
+        send_messages = mock.Mock(side_effect=[1, ConnectionError])
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', send_messages), \
+                self.assertRaises(ConnectionError):
+            send_feed_digests()
+
+        self.assertEqual(FeedDigest.objects.get().user, self.readers[0])
+        # the resumed run skips the digest which went out
+        self.assertEqual(send_feed_digests(), 2)
+
+    def test_digest_is_sent_once_per_window(self):
+        send_feed_digests()
+        Post.objects.create(topic=self.topic, post_body="Another post", author=self.writer)
+        self.assertEqual(send_feed_digests(), 0)
 
-# Create your tests here.
+        FeedDigest.objects.update(last_sent_at=timezone.now() - datetime.timedelta(days=2))
+        self.assertEqual(send_feed_digests(), 3)
@@ -6,6 +6,10 @@ from . import views
 app_name = 'feed'
 urlpatterns = [
     path('forums/topic/<int:topic_id>/subscription/', views.SubscribeTopicView.as_view(), name='subscription'),
+    path('forums/topic/<int:topic_id>/mark-all-read/', views.MarkAllReadView.as_view(), name='mark_topic_read'),
     path('feed/', views.FeedView.as_view(), name='feed'),
+    path('feed/mark-all-read/', views.MarkAllReadView.as_view(), name='mark_all_read'),
+    path('feed/mark-read/', views.MarkPostsReadView.as_view(), name='mark_posts_read'),
     path('post/<int:post_id>/mark-read/', views.MarkReadView.as_view(), name='mark_read'),
+    path('post/<int:post_id>/mark-read-up-to/', views.MarkReadView.as_view(up_to=True), name='mark_read_up_to'),
 ]
\ No newline at end of file
@@ -2,11 +2,17 @@ from django.shortcuts import redirect, get_object_or_404
 from django.views import generic
 from django.views.generic.base import View
 from django.contrib.auth.models import User
-from django.http import Http404, JsonResponse, HttpResponseNotFound
+from django.http import JsonResponse, HttpResponseNotFound, HttpResponseBadRequest
+from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 
 from .models import Subscription, ReadPost
+from .tasks import backfill_feed, purge_feed, publish_subscription_event
+from .read_marks import mark_read, mark_read_up_to, mark_posts_read, mark_topic_read, unread_entries, \
+    unread_pulled_posts
 from core.views import CheckUserMixin
+from core.pagination import KeysetPage, KeysetPaginator, encode_cursor
 from discussions.models import Topic, Post
 
 
@@ -21,56 +27,122 @@ class SubscribeTopicView(CheckUserMixin, View):
         try:
             subscription = Subscription.objects.get(user=user, topic=topic)
 
-            # remove info about read posts when unsubscribing
-            read_posts = ReadPost.objects.filter(user=self.request.user,
-                                                 post__in=Post.objects.filter(topic=subscription.topic))
-
-            for read_post in read_posts:
-                read_post.delete()
-
-            subscription.delete()
+            with transaction.atomic():
+                # remove info about read posts when unsubscribing, as a single DELETE
+                ReadPost.objects.filter(user=user, post__topic=topic).delete()
+                subscription.delete()
+            # the topic's posts are removed from the feed in the background
+            transaction.on_commit(lambda: purge_feed.delay(user.pk, topic.pk))
             status = {'code': '200', 'message': 'Subscription removed'}
         except ObjectDoesNotExist:
-            Subscription(user=user, topic=topic).save()
+            with transaction.atomic():
+                subscription = Subscription.objects.create(user=user, topic=topic)
+                # add the posts which were fanned out before the subscription was committed
+                transaction.on_commit(lambda: backfill_feed.delay(subscription.pk))
             status = {'code': '200', 'message': 'Subscription created'}
 
+        # the user's open feed streams reload the subscribed topics
+        transaction.on_commit(lambda: publish_subscription_event.delay(user.pk))
         return JsonResponse(status)
 
 
-class FeedView(CheckUserMixin, generic.ListView):
+class FeedView(CheckUserMixin, generic.TemplateView):
+    """
+    The feed merges two sources, each read a page at a time along its index: the entries
+    fanned out to the user when the posts were created and, for the topics with too many
+    subscribers to fan out (see tasks.py), the posts pulled from the topics themselves
+    """
     template_name = 'feed/feed.html'
-    context_object_name = 'posts_list'
-
-    def get_queryset(self):
-        subscriptions = Subscription.objects.filter(user=self.request.user)
-        posts_list = []
-
-        for subscription in subscriptions:
-            posts = Post.objects.filter(topic=subscription.topic) \
-                .exclude(creation_date__lte=subscription.creation_date)
-
-            read_posts = ReadPost.objects.filter(user=self.request.user).values_list('post', flat=True)
-            posts = posts.exclude(pk__in=read_posts).exclude(author=self.request.user)
-
-            posts_list.extend(posts)
-
-        return sorted(posts_list, key=lambda x: x.creation_date, reverse=True)
+    paginate_by = 20
+
+    def get_entries_queryset(self):
+        return unread_entries(self.request.user).select_related('post__topic', 'post__author__profile')
+
+    def get_pulled_queryset(self):
+        return unread_pulled_posts(self.request.user).select_related('topic', 'author__profile')
+
+    def get_posts_page(self, after=None, before=None):
+        forward = not before
+        cursor = before or after
+
+        # both sources are ordered by (creation date, post id), so they share the cursor
+        entries = KeysetPaginator(self.get_entries_queryset(), ('-creation_date', '-post_id'),
+                                  self.paginate_by).rows(cursor, forward)
+        pulled = KeysetPaginator(self.get_pulled_queryset(), ('-creation_date', '-pk'),
+                                 self.paginate_by).rows(cursor, forward)
+
+        posts = {entry.post.pk: entry.post for entry in entries}
+        posts.update((post.pk, post) for post in pulled)
+        # in the direction of moving from the cursor, like the rows of the sources
+        posts_list = sorted(posts.values(), key=lambda post: (post.creation_date, post.pk), reverse=forward)
+        has_more = len(posts_list) > self.paginate_by or len(entries) > self.paginate_by \
+            or len(pulled) > self.paginate_by
+        posts_list = posts_list[:self.paginate_by]
+
+        if forward:
+            return KeysetPage(posts_list,
+                              next_cursor=self.get_cursor(posts_list[-1]) if has_more else None,
+                              previous_cursor=self.get_cursor(posts_list[0]) if after and posts_list else None)
+
+        if not posts_list:
+            return self.get_posts_page()
+        posts_list.reverse()
+        return KeysetPage(posts_list, next_cursor=self.get_cursor(posts_list[-1]),
+                          previous_cursor=self.get_cursor(posts_list[0]) if has_more else None)
+
+    @staticmethod
+    def get_cursor(post):
+        return encode_cursor([post.creation_date.isoformat(), post.pk])
 
     def get_context_data(self, **kwargs):
         context = super(FeedView, self).get_context_data(**kwargs)
+        posts_page = self.get_posts_page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        posts_page.set_querystrings(self.request.GET)
+        context['posts_list'] = posts_page.object_list
+        context['page_obj'] = posts_page
         context['page_title'] = 'Feed'
         return context
 
 
 class MarkReadView(CheckUserMixin, View):
+    # with up_to=True the post and all the older posts of the feed are marked as read
+    up_to = False
+
     def get(self, request, post_id):
-        user = get_object_or_404(User, id=request.user.pk)
         post = get_object_or_404(Post, id=post_id)
 
-        try:
-            get_object_or_404(ReadPost, user=user, post=post)
+        if self.up_to:
+            mark_read_up_to(request.user, post.creation_date)
+        elif not mark_read(request.user, post):
             return HttpResponseNotFound("This post is already marked as read by user")
-        except Http404:
-            read_post = ReadPost(user=user, post=post)
-            read_post.save()
+        return redirect('feed:feed')
+
+
+class MarkPostsReadView(CheckUserMixin, View):
+    """
+    Marks the posts with the ids sent as `post_ids` (repeated) POST parameter as read
+    """
+    def post(self, request):
+        if not request.is_ajax():
+            return HttpResponseNotFound("Page not found")
+
+        try:
+            post_ids = [int(post_id) for post_id in request.POST.getlist('post_ids')]
+        except ValueError:
+            return HttpResponseBadRequest("Bad request")
+
+        mark_posts_read(request.user, post_ids)
+        return JsonResponse({'code': '200', 'message': 'Posts marked as read', 'post_ids': post_ids})
+
+
+class MarkAllReadView(CheckUserMixin, View):
+    """
+    Marks all the posts of the topic (if topic_id is given) or of the whole feed as read
+    """
+    def get(self, request, topic_id=None):
+        if topic_id is None:
+            mark_read_up_to(request.user, timezone.now())
             return redirect('feed:feed')
+
+        mark_topic_read(request.user, topic_id)
+        return redirect('discussions:topic', topic_id=topic_id)
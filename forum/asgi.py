@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'forum.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once the apps are loaded, the feed stream is served outside of Django's views
+from feed.streaming import FeedStreamRouter  # noqa: E402
+
+application = FeedStreamRouter(django_application)
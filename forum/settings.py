@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -37,6 +38,7 @@ INSTALLED_APPS = [
     'feed.apps.FeedConfig',
     'messaging.apps.MessagingConfig',
     'discussions.apps.DiscussionsConfig',
+    'search.apps.SearchConfig',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -54,6 +56,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.IdentityMapMiddleware',
 ]
 
 ROOT_URLCONF = 'forum.urls'
@@ -83,6 +86,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.unread_counters',
             ],
         },
     },
@@ -106,6 +110,13 @@ DATABASES = {
 }
 
 
+# the users are loaded with their profiles and cached, see core/backends.py.
+# ModelBackend keeps the sessions which were started before working
+AUTHENTICATION_BACKENDS = [
+    'core.backends.ProfileModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -152,3 +163,47 @@ REDIS_PORT = '6379'
 CELERY_BROKER_URL = 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/0'
 CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}
 CELERY_RESULT_BACKEND = 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/0'
+
+# Periodic tasks, run by `celery -A forum beat`
+CELERY_BEAT_SCHEDULE = {
+    'rebuild-topic-leaderboards': {
+        'task': 'discussions.tasks.rebuild_topic_leaderboards',
+        'schedule': 10 * 60,
+    },
+    'reconcile-unread-counters': {
+        'task': 'core.tasks.reconcile_unread_counters',
+        'schedule': 60 * 60,
+    },
+    'collect-deleted-messages': {
+        'task': 'messaging.tasks.collect_deleted_messages',
+        'schedule': 24 * 60 * 60,
+    },
+    # every user gets at most one digest a day, see feed/digests.py
+    'send-feed-digests': {
+        'task': 'feed.tasks.send_feed_digests',
+        'schedule': 60 * 60,
+    },
+}
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/1',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+    }
+}
+
+# Live feed stream (feed/streaming.py), its events are shared between the ASGI workers through Redis pub/sub
+FEED_STREAM_BROKER = 'feed.broker.RedisBroker'
+FEED_STREAM_REDIS_URL = 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/2'
+
+# tests run with the local-memory cache and eager Celery tasks, so they don't depend on (and don't pollute) Redis
+if 'test' in sys.argv:
+    CACHES['default'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    CELERY_TASK_ALWAYS_EAGER = True
+    FEED_STREAM_BROKER = 'feed.broker.InProcessBroker'
+    EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
@@ -28,6 +28,7 @@ urlpatterns = [
     path('', include('messaging.urls')),
     path('', include('feed.urls')),
     path('', include('profiles.urls')),
+    path('', include('search.urls')),
     path('admin/', admin.site.urls),
 ]
 
@@ -1,7 +1,11 @@
 from django.contrib import admin
 
-from .models import Message, DeletedMessage, ReadMessages
+from .models import Message, MailboxEntry
+
+
+class MailboxEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'message', 'folder', 'is_read', 'deleted_at')
+
 
 admin.site.register(Message)
-admin.site.register(DeletedMessage)
-admin.site.register(ReadMessages)
+admin.site.register(MailboxEntry, MailboxEntryAdmin)
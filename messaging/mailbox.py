@@ -0,0 +1,145 @@
+"""
+State transitions of the messages in the users' mailboxes. Each one locks the user's entry of the message
+with a single indexed query and changes it with a single UPDATE, the receiver's unread messages counter
+(unread entries in the inbox) is changed in the same transaction.
+The messages left out of all the mailboxes are deleted periodically, see collect_deleted_messages().
+"""
+import datetime
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from core.models import UnreadCounter
+from core.counters import change_unread_counter
+from .models import Message, MailboxEntry, MailboxMigration
+
+# messages deleted by the garbage collection per transaction
+COLLECT_BATCH_SIZE = 1000
+
+# the entries of a new message are created right after it, so the youngest messages are skipped
+COLLECT_GRACE_PERIOD = datetime.timedelta(hours=1)
+
+
+def create_entries(message):
+    """Put a new message into the outbox of its sender and the inbox of its receiver"""
+    entries = []
+    if message.sender_id and message.sender_id != message.receiver_id:
+        entries.append(MailboxEntry(user_id=message.sender_id, message=message, folder=MailboxEntry.OUTBOX,
+                                    created_at=message.created_at))
+    if message.receiver_id:
+        entries.append(MailboxEntry(user_id=message.receiver_id, message=message, folder=MailboxEntry.INBOX,
+                                    created_at=message.created_at))
+        change_unread_counter(UnreadCounter.MESSAGES, [message.receiver_id], 1)
+    MailboxEntry.objects.bulk_create(entries)
+
+
+def get_entry(user, message_id):
+    return MailboxEntry.objects.select_for_update().filter(user=user, message_id=message_id).first()
+
+
+def is_unread_in_inbox(entry):
+    return entry.folder == MailboxEntry.INBOX and not entry.is_read
+
+
+@transaction.atomic
+def set_read(user, message_id, is_read):
+    """Mark the message as read or unread, return False if it isn't in the user's mailbox"""
+    entry = get_entry(user, message_id)
+    if entry is None:
+        return False
+
+    if entry.is_read != is_read:
+        MailboxEntry.objects.filter(pk=entry.pk).update(is_read=is_read)
+        if entry.folder == MailboxEntry.INBOX:
+            change_unread_counter(UnreadCounter.MESSAGES, [user.pk], -1 if is_read else 1)
+    return True
+
+
+@transaction.atomic
+def move_to_bucket(user, message_id):
+    entry = get_entry(user, message_id)
+    if entry is None or entry.folder == MailboxEntry.BUCKET:
+        return False
+
+    MailboxEntry.objects.filter(pk=entry.pk).update(folder=MailboxEntry.BUCKET, deleted_at=timezone.now())
+    if is_unread_in_inbox(entry):
+        change_unread_counter(UnreadCounter.MESSAGES, [user.pk], -1)
+    return True
+
+
+@transaction.atomic
+def restore(user, message):
+    """Move the message from the bucket back to the inbox or the outbox"""
+    entry = get_entry(user, message.pk)
+    if entry is None or entry.folder != MailboxEntry.BUCKET:
+        return False
+
+    entry.folder = MailboxEntry.INBOX if message.receiver_id == user.pk else MailboxEntry.OUTBOX
+    MailboxEntry.objects.filter(pk=entry.pk).update(folder=entry.folder, deleted_at=None)
+    if is_unread_in_inbox(entry):
+        change_unread_counter(UnreadCounter.MESSAGES, [user.pk], 1)
+    return True
+
+
+@transaction.atomic
+def delete_permanently(user, message_id):
+    """
+    Remove the message from the user's bucket, the message itself is deleted when the other participant
+    has deleted it permanently too (the messages left by concurrent deletions are collected later)
+    """
+    deleted, _ = MailboxEntry.objects.filter(user=user, message_id=message_id, folder=MailboxEntry.BUCKET).delete()
+    if not deleted:
+        return False
+
+    if not MailboxEntry.objects.filter(message_id=message_id).exists():
+        Message.objects.filter(pk=message_id).delete()
+    return True
+
+
+def is_migrated():
+    """Whether the messages sent before the mailbox entries were migrated, see MailboxMigration"""
+    return MailboxMigration.objects.exists()
+
+
+def collected_messages():
+    """
+    Messages which aren't in any mailbox: deleted permanently by both participants (also concurrently,
+    see delete_permanently) or whose participants' accounts are removed
+    """
+    entries = MailboxEntry.objects.filter(message=OuterRef('pk'))
+    return Message.objects.filter(created_at__lt=timezone.now() - COLLECT_GRACE_PERIOD).filter(~Exists(entries))
+
+
+def collect_deleted_messages(batch_size=COLLECT_BATCH_SIZE):
+    """
+    Delete the messages which aren't in any mailbox, a batch per transaction so the locks are held briefly.
+    Nothing is deleted until the existing messages are migrated (the legacy ones have no entries before).
+    Return the amount of deleted messages, batches and the duration in seconds.
+    """
+    started = time.monotonic()
+    deleted = batches = 0
+
+    if not is_migrated():
+        logging.warning("Deleted messages aren't collected until the migrate_mailbox_entries command has run")
+        return {'deleted': deleted, 'batches': batches, 'duration': 0}
+
+    # a single walk along the primary keys, the messages left behind aren't scanned again
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            chunk = list(collected_messages().filter(pk__gt=last_pk).order_by('pk')
+                         .values_list('pk', flat=True)[:batch_size])
+            if not chunk:
+                break
+            Message.objects.filter(pk__in=chunk).delete()
+
+        deleted += len(chunk)
+        batches += 1
+        last_pk = chunk[-1]
+
+    stats = {'deleted': deleted, 'batches': batches, 'duration': round(time.monotonic() - started, 3)}
+    logging.info("Collected deleted messages: %(deleted)s messages in %(batches)s batches, %(duration)ss" % stats)
+    return stats
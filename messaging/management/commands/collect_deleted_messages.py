@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from messaging.mailbox import collect_deleted_messages, is_migrated, COLLECT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Delete the messages which aren't in any user's mailbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=COLLECT_BATCH_SIZE,
+                            help="Amount of messages deleted per transaction")
+
+    def handle(self, *args, **options):
+        if not is_migrated():
+            raise CommandError("Run the migrate_mailbox_entries command first, the messages sent before "
+                               "the upgrade have no mailbox entries until then")
+
+        stats = collect_deleted_messages(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {stats['deleted']} messages in {stats['batches']} batches ({stats['duration']}s)"))
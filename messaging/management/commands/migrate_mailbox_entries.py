@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from messaging.models import Message, MailboxEntry, MailboxMigration, DeletedMessage, ReadMessages
+
+
+class Command(BaseCommand):
+    help = "Create the mailbox entries of the existing messages from the deleted and read messages tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Amount of messages migrated per transaction")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = Message.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        # the legacy tables don't store when the messages were deleted
+        now = timezone.now()
+        migrated = 0
+
+        for start in range(0, last_pk, batch_size):
+            with transaction.atomic():
+                messages = list(Message.objects.filter(pk__gt=start, pk__lte=start + batch_size)
+                                .values_list('pk', 'sender_id', 'receiver_id', 'created_at'))
+                deleted = dict(((user_id, message_id), permanently) for user_id, message_id, permanently
+                               in DeletedMessage.objects.filter(message__gt=start, message__lte=start + batch_size)
+                               .values_list('user_id', 'message_id', 'is_deleted_permanently'))
+                read = set(ReadMessages.objects.filter(message__gt=start, message__lte=start + batch_size)
+                           .values_list('user_id', 'message_id'))
+
+                entries = []
+                for pk, sender_id, receiver_id, created_at in messages:
+                    participants = {sender_id: MailboxEntry.OUTBOX, receiver_id: MailboxEntry.INBOX}
+                    for user_id, folder in participants.items():
+                        # permanently deleted messages have no entries
+                        if user_id is None or deleted.get((user_id, pk)):
+                            continue
+                        is_deleted = (user_id, pk) in deleted
+                        entries.append(MailboxEntry(user_id=user_id, message_id=pk, created_at=created_at,
+                                                    folder=MailboxEntry.BUCKET if is_deleted else folder,
+                                                    deleted_at=now if is_deleted else None,
+                                                    is_read=(user_id, pk) in read))
+
+                # the entries of the messages sent after the upgrade exist already
+                MailboxEntry.objects.bulk_create(entries, ignore_conflicts=True)
+            migrated += len(messages)
+
+        # the later messages got their entries when they were sent, the garbage collection can start now
+        MailboxMigration.objects.create(last_message_id=last_pk)
+        self.stdout.write(self.style.SUCCESS(f"Migrated mailbox entries of {migrated} messages"))
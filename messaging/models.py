@@ -14,7 +14,47 @@ class Message(models.Model):
         return f'{self.sender} --> {self.receiver}: {self.subject}'
 
 
+class MailboxEntry(models.Model):
+    """
+    The state of a message in the mailbox of one of its participants, see mailbox.py.
+    A permanently deleted message has no entry of the user, the message itself is deleted
+    when none of its entries is left.
+    """
+    INBOX = 'inbox'
+    OUTBOX = 'outbox'
+    BUCKET = 'bucket'
+    FOLDER_CHOICES = [
+        (INBOX, 'Inbox'),
+        (OUTBOX, 'Outbox'),
+        (BUCKET, 'Bucket'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="mailbox_entries")
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name="mailbox_entries")
+    folder = models.CharField(max_length=10, choices=FOLDER_CHOICES)
+    is_read = models.BooleanField(default=False)
+    # when the message was moved to the bucket
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # denormalized from the message, so the mailbox pages are read along a single index
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.user} - {self.message_id} ({self.folder})'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'message'], name='unique_user_mailbox_message'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'folder', '-created_at', '-message']),
+        ]
+
+
 class DeletedMessage(models.Model):
+    """
+    Legacy mailbox state, replaced by MailboxEntry. Kept until the existing rows are moved
+    with the migrate_mailbox_entries command.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.ForeignKey(Message, on_delete=models.CASCADE)
     is_deleted_permanently = models.BooleanField(default=False)
@@ -24,8 +64,24 @@ class DeletedMessage(models.Model):
 
 
 class ReadMessages(models.Model):
+    """
+    Legacy mailbox state, replaced by MailboxEntry. Kept until the existing rows are moved
+    with the migrate_mailbox_entries command.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.ForeignKey(Message, on_delete=models.CASCADE)
 
     def __str__(self):
         return str(self.user) + " - " + str(self.message.subject)
+
+
+class MailboxMigration(models.Model):
+    """
+    Recorded by the migrate_mailbox_entries command when the messages up to `last_message_id` have their
+    mailbox entries. Before that the messages without entries can be legacy ones, so none are collected.
+    """
+    last_message_id = models.IntegerField()
+    migrated_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Messages up to {self.last_message_id} migrated at {self.migrated_at}'
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Message
+from .mailbox import create_entries
+
+
+# put new message into the mailboxes of its participants and increase the receiver's unread messages counter
+@receiver(post_save, sender=Message)
+def create_entries_when_message_add(sender, instance, created, **kwargs):
+    if created:
+        create_entries(instance)
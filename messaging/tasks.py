@@ -0,0 +1,8 @@
+from . import mailbox
+
+from forum.celery import app
+
+
+@app.task
+def collect_deleted_messages():
+    return mailbox.collect_deleted_messages()
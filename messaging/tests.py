@@ -1,3 +1,153 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import UnreadCounter
+from .models import Message, MailboxEntry, MailboxMigration, DeletedMessage, ReadMessages
+from .mailbox import set_read, move_to_bucket, delete_permanently, collect_deleted_messages
+from .views import MailboxView
+
+
+class MailboxViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user', password='1X<ISRUkw+tuK')
+        cls.other_user = User.objects.create_user(username='other', password='2HJ1vRV0Z&3iD')
+
+        for i in range(25):
+            Message.objects.create(sender=cls.other_user, receiver=cls.user, subject=f"Received {i}")
+            Message.objects.create(sender=cls.user, receiver=cls.other_user, subject=f"Sent {i}")
+
+        cls.read_message = Message.objects.get(subject="Received 24")
+        set_read(cls.user, cls.read_message.pk, True)
+        cls.deleted_message = Message.objects.get(subject="Received 23")
+        move_to_bucket(cls.user, cls.deleted_message.pk)
+        permanently_deleted_message = Message.objects.get(subject="Received 22")
+        move_to_bucket(cls.user, permanently_deleted_message.pk)
+        delete_permanently(cls.user, permanently_deleted_message.pk)
+
+    def setUp(self):
+        self.client.login(username='user', password='1X<ISRUkw+tuK')
+
+    def test_inbox_is_a_single_query(self):
+        # session, user with profile, mailbox entries page, user's unread counters
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('messaging:inbox'))
+
+        messages = response.context['received_messages_list']
+        self.assertEqual(len(messages), MailboxView.paginate_by)
+        self.assertEqual(messages[0], self.read_message)
+        self.assertTrue(messages[0].is_read)
+        self.assertFalse(messages[1].is_read)
+        self.assertEqual(messages[1].subject, "Received 21")
+
+        response = self.client.get(reverse('messaging:inbox') + '?' + response.context['page_obj'].next_querystring)
+        self.assertEqual(len(response.context['received_messages_list']), 3)
+        self.assertFalse(response.context['page_obj'].has_next())
+
+    def test_outbox_shows_sent_messages(self):
+        response = self.client.get(reverse('messaging:outbox'))
+        messages = response.context['sent_messages_list']
+        self.assertEqual(messages[0].subject, "Sent 24")
+        self.assertTrue(all(message.sender == self.user for message in messages))
+
+    def test_bucket_shows_messages_deleted_not_permanently(self):
+        response = self.client.get(reverse('messaging:bucket'))
+        self.assertEqual(list(response.context['deleted_messages_list']), [self.deleted_message])
+
+
+class MailboxTransitionsTests(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username='sender', password='1X<ISRUkw+tuK')
+        self.receiver = User.objects.create_user(username='receiver', password='2HJ1vRV0Z&3iD')
+        self.message = Message.objects.create(sender=self.sender, receiver=self.receiver, subject="Message")
+
+    def get_unread_messages(self):
+        return UnreadCounter.objects.get(user=self.receiver).messages
+
+    def test_message_is_deleted_when_both_participants_delete_it_permanently(self):
+        self.client.login(username='receiver', password='2HJ1vRV0Z&3iD')
+        delete_url = reverse('messaging:delete_message', kwargs={'message_id': self.message.pk})
+
+        self.assertRedirects(self.client.get(delete_url), reverse('messaging:inbox'), fetch_redirect_response=False)
+        self.assertEqual(MailboxEntry.objects.get(user=self.receiver).folder, MailboxEntry.BUCKET)
+        self.assertEqual(self.get_unread_messages(), 0)
+
+        self.client.get(reverse('messaging:restore_message', kwargs={'message_id': self.message.pk}))
+        self.assertEqual(MailboxEntry.objects.get(user=self.receiver).folder, MailboxEntry.INBOX)
+        self.assertEqual(self.get_unread_messages(), 1)
+
+        self.client.get(delete_url)
+        self.assertRedirects(self.client.get(delete_url), reverse('messaging:bucket'), fetch_redirect_response=False)
+        self.assertTrue(Message.objects.filter(pk=self.message.pk).exists())
+
+        move_to_bucket(self.sender, self.message.pk)
+        delete_permanently(self.sender, self.message.pk)
+        self.assertFalse(Message.objects.filter(pk=self.message.pk).exists())
+
+    def test_read_status_changes_unread_counter(self):
+        self.assertTrue(set_read(self.receiver, self.message.pk, True))
+        self.assertEqual(self.get_unread_messages(), 0)
+        # the counter isn't changed twice
+        set_read(self.receiver, self.message.pk, True)
+        self.assertEqual(self.get_unread_messages(), 0)
+
+        set_read(self.receiver, self.message.pk, False)
+        self.assertEqual(self.get_unread_messages(), 1)
+
+    def test_migrate_mailbox_entries_command(self):
+        MailboxEntry.objects.all().delete()
+        deleted_message = Message.objects.create(sender=self.sender, receiver=self.receiver, subject="Deleted")
+        MailboxEntry.objects.filter(message=deleted_message).delete()
+        ReadMessages.objects.create(user=self.receiver, message=self.message)
+        DeletedMessage.objects.create(user=self.receiver, message=deleted_message)
+        DeletedMessage.objects.create(user=self.sender, message=deleted_message, is_deleted_permanently=True)
+
+        out = StringIO()
+        call_command('migrate_mailbox_entries', batch_size=1, stdout=out)
+
+        self.assertEqual(set(MailboxEntry.objects.values_list('user', 'message', 'folder', 'is_read')), {
+            (self.sender.pk, self.message.pk, MailboxEntry.OUTBOX, False),
+            (self.receiver.pk, self.message.pk, MailboxEntry.INBOX, True),
+            (self.receiver.pk, deleted_message.pk, MailboxEntry.BUCKET, False),
+        })
+        self.assertIn("Migrated mailbox entries of 2 messages", out.getvalue())
+
+    def test_collect_deleted_messages(self):
+        MailboxMigration.objects.create(last_message_id=self.message.pk)
+        other_user = User.objects.create_user(username='other', password='3HJ1vRV0Z&3iD')
+        removed_users_message = Message.objects.create(sender=other_user, receiver=self.receiver, subject="Removed")
+        MailboxEntry.objects.filter(message=removed_users_message).delete()
+        new_message = Message.objects.create(sender=self.sender, receiver=self.receiver, subject="New")
+        MailboxEntry.objects.filter(message=new_message).delete()
+        Message.objects.exclude(pk=new_message.pk).update(created_at=timezone.now() - datetime.timedelta(days=1))
+
+        out = StringIO()
+        call_command('collect_deleted_messages', batch_size=1, stdout=out)
+
+        self.assertEqual(set(Message.objects.all()), {self.message, new_message})
+        self.assertIn("Deleted 1 messages in 1 batches", out.getvalue())
+
+    def test_legacy_messages_are_not_collected_before_migration(self):
+        read_message = Message.objects.create(sender=self.sender, receiver=self.receiver, subject="Read")
+        deleted_message = Message.objects.create(sender=self.sender, receiver=self.receiver, subject="Deleted")
+        # the messages sent before the upgrade have no mailbox entries
+        MailboxEntry.objects.all().delete()
+        ReadMessages.objects.create(user=self.receiver, message=read_message)
+        DeletedMessage.objects.create(user=self.sender, message=deleted_message)
+        Message.objects.update(created_at=timezone.now() - datetime.timedelta(days=1))
+
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(collect_deleted_messages()['deleted'], 0)
+        with self.assertRaises(CommandError):
+            call_command('collect_deleted_messages', stdout=StringIO())
+        self.assertEqual(Message.objects.count(), 3)
 
-# Create your tests here.
+        call_command('migrate_mailbox_entries', stdout=StringIO())
+        self.assertEqual(collect_deleted_messages()['deleted'], 0)
+        self.assertEqual(Message.objects.count(), 3)
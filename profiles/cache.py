@@ -0,0 +1,32 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from core.pagination import KeysetPage
+
+# the first page of the user's activity is cached until the user posts, the votes and the topics' titles
+# shown on it aren't tracked, so it's refreshed at least this often
+ACTIVITY_TIMEOUT = 5 * 60
+
+
+def activity_key(author_id):
+    return f'profiles:activity:{author_id}:first_page'
+
+
+def get_first_activity_page(author_id, paginator):
+    """Return the first page of the `paginator` of the author's posts from the cache"""
+    key = activity_key(author_id)
+    cached = cache.get(key)
+    if cached is None:
+        page = paginator.page()
+        cached = (page.object_list, page.next_cursor)
+        cache.set(key, cached, ACTIVITY_TIMEOUT)
+
+    posts, next_cursor = cached
+    return KeysetPage(posts, next_cursor=next_cursor)
+
+
+def invalidate_activity(author_id):
+    # deleted once more after the commit, so a concurrent request doesn't cache uncommitted data
+    key = activity_key(author_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
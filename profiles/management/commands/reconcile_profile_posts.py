@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+
+from discussions.models import Post
+from profiles.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Recalculate post_count and last_post_at of profiles, also fills them when upgrading"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Amount of profiles reconciled per transaction")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        fixed = 0
+
+        # each chunk of profiles is locked while it's reconciled, so concurrent updates made by the signals
+        # are applied on top of the recalculated values instead of being lost
+        while True:
+            with transaction.atomic():
+                profiles = list(Profile.objects.select_for_update().filter(pk__gt=last_pk).order_by('pk')
+                                .only('pk', 'user_id', 'post_count', 'last_post_at')[:batch_size])
+                if not profiles:
+                    break
+
+                # a single aggregate query per chunk
+                actual = {author_id: (amount, last_post_at) for author_id, amount, last_post_at
+                          in Post.objects.filter(author_id__in=[profile.user_id for profile in profiles]).order_by()
+                          .values('author_id').annotate(amount=Count('pk'), last_post_at=Max('creation_date'))
+                          .values_list('author_id', 'amount', 'last_post_at')}
+
+                changed = []
+                for profile in profiles:
+                    values = actual.get(profile.user_id, (0, None))
+                    if (profile.post_count, profile.last_post_at) != values:
+                        profile.post_count, profile.last_post_at = values
+                        changed.append(profile)
+                Profile.objects.bulk_update(changed, ['post_count', 'last_post_at'])
+
+            fixed += len(changed)
+            last_pk = profiles[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Fixed post counts of {fixed} profiles"))
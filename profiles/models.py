@@ -1,6 +1,7 @@
+from collections import namedtuple
+
 from django.db import models
 from django.contrib.auth.models import User
-from discussions.models import Post
 
 
 def user_directory_path(instance, filename):
@@ -8,21 +9,48 @@ def user_directory_path(instance, filename):
     return '{0}/{1}'.format(instance.user.username, filename)
 
 
+# sizes of the avatar thumbnails (twice the size they are shown at, for high density screens)
+AVATAR_THUMBNAIL_SIZES = {
+    'small': (70, 60),
+    'medium': (90, 90),
+}
+
+AvatarThumbnail = namedtuple('AvatarThumbnail', ['webp', 'png'])
+
+
+def avatar_thumbnail_path(instance, avatar_hash, size, extension):
+    """The thumbnail is stored next to the avatar, under the name made of the avatar's content hash"""
+    width, height = AVATAR_THUMBNAIL_SIZES[size]
+    return user_directory_path(instance, f'avatar-{avatar_hash}-{width}x{height}.{extension}')
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
     user_location = models.CharField(max_length=30, blank=True)
     user_about = models.TextField(max_length=500, blank=True)
     user_avatar = models.ImageField(upload_to=user_directory_path, blank=True, default='/default.png')
+    # maintained by the signals (see signals.py), reconciled by the reconcile_profile_posts command
+    post_count = models.IntegerField(default=0)
+    last_post_at = models.DateTimeField(null=True, blank=True)
+    # content hash of the avatar, set when its thumbnails are made (see tasks.py)
+    avatar_hash = models.CharField(max_length=16, blank=True)
 
     def __str__(self):
         return self.user.get_full_name()
 
-    def user_posts_amount(self):
-        return len(Post.objects.filter(author=self.user))
+    def avatar_thumbnail(self, size):
+        """URLs of the avatar thumbnail, the original avatar is used until the thumbnails are made"""
+        if not self.avatar_hash:
+            return AvatarThumbnail(None, self.user_avatar.url)
+
+        storage = self.user_avatar.storage
+        return AvatarThumbnail(*(storage.url(avatar_thumbnail_path(self, self.avatar_hash, size, extension))
+                                 for extension in ('webp', 'png')))
+
+    @property
+    def small_avatar(self):
+        return self.avatar_thumbnail('small')
 
-    def user_last_forum_activity_date(self):
-        posts = Post.objects.filter(author=self.user)
-        if len(posts) > 0:
-            return posts.order_by('-creation_date')[0].creation_date
-        else:
-            return "-"
+    @property
+    def medium_avatar(self):
+        return self.avatar_thumbnail('medium')
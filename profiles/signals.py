@@ -1,11 +1,46 @@
 from django.contrib.auth.models import User
 from .models import Profile
-from django.db.models.signals import post_save
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
+from discussions.models import Post
+from .cache import invalidate_activity
+
 
 # create user profile when new user is registered
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        Profile.objects.create(user=instance)
\ No newline at end of file
+        Profile.objects.create(user=instance)
+
+
+# increase the author's posts counter and move the last activity date with a single UPDATE
+@receiver(post_save, sender=Post)
+def update_profile_when_post_add(sender, instance, created, **kwargs):
+    if created and instance.author_id:
+        Profile.objects.filter(user_id=instance.author_id).update(post_count=F('post_count') + 1,
+                                                                  last_post_at=instance.creation_date)
+
+
+# decrease the author's posts counter, the last activity date falls back to the previous post
+# if the deleted post was the last one
+@receiver(post_delete, sender=Post)
+def update_profile_when_post_delete(sender, instance, **kwargs):
+    if not instance.author_id:
+        return
+
+    profiles = Profile.objects.filter(user_id=instance.author_id)
+    # the counters of the posts created before the upgrade are 0 until they are reconciled
+    profiles.update(post_count=Greatest(F('post_count') - 1, 0))
+    last_posts = Post.objects.filter(author=OuterRef('user_id')).order_by('-creation_date').values('creation_date')
+    profiles.filter(last_post_at__lte=instance.creation_date).update(last_post_at=Subquery(last_posts[:1]))
+
+
+# drop the cached first page of the author's activity
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_activity_when_post_change(sender, instance, **kwargs):
+    if instance.author_id:
+        invalidate_activity(instance.author_id)
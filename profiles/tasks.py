@@ -0,0 +1,61 @@
+import hashlib
+import posixpath
+import re
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from django.core.files.base import ContentFile
+
+from core.backends import invalidate_user
+from .models import Profile, AVATAR_THUMBNAIL_SIZES, avatar_thumbnail_path
+
+from forum.celery import app
+
+THUMBNAIL_NAME = re.compile(r'^avatar-(?P<hash>[0-9a-f]+)-\d+x\d+\.(webp|png)$')
+
+
+def make_thumbnail(image, size, image_format):
+    thumbnail = ImageOps.fit(image, AVATAR_THUMBNAIL_SIZES[size], Image.LANCZOS)
+    content = BytesIO()
+    thumbnail.save(content, image_format)
+    return ContentFile(content.getvalue())
+
+
+def delete_old_thumbnails(profile, storage, avatar_hash):
+    """Delete the thumbnails of the avatars the profile had before the one with `avatar_hash`"""
+    directory = posixpath.dirname(avatar_thumbnail_path(profile, avatar_hash, 'small', 'png'))
+    _, names = storage.listdir(directory)
+    for name in names:
+        match = THUMBNAIL_NAME.match(name)
+        if match and match.group('hash') != avatar_hash:
+            storage.delete(posixpath.join(directory, name))
+
+
+@app.task
+def make_avatar_thumbnails(profile_id):
+    """
+    Make the WebP and PNG thumbnails of the profile's avatar. Their names contain the hash
+    of the avatar's content, so their URLs can be cached forever.
+    """
+    profile = Profile.objects.select_related('user').filter(pk=profile_id).first()
+    if profile is None or not profile.user_avatar:
+        return
+
+    avatar_name = profile.user_avatar.name
+    with profile.user_avatar.open('rb') as avatar:
+        content = avatar.read()
+    avatar_hash = hashlib.sha256(content).hexdigest()[:16]
+
+    image = Image.open(BytesIO(content)).convert('RGBA')
+    storage = profile.user_avatar.storage
+    for size in AVATAR_THUMBNAIL_SIZES:
+        for extension, image_format in (('webp', 'WEBP'), ('png', 'PNG')):
+            path = avatar_thumbnail_path(profile, avatar_hash, size, extension)
+            if not storage.exists(path):
+                storage.save(path, make_thumbnail(image, size, image_format))
+
+    # the avatar could have been replaced meanwhile, its own task sets its hash
+    if Profile.objects.filter(pk=profile_id, user_avatar=avatar_name).update(avatar_hash=avatar_hash):
+        invalidate_user(profile.user_id)
+        # the cached posts' fragments with the old thumbnails aren't read anymore, see discussions/cache.py
+        delete_old_thumbnails(profile, storage, avatar_hash)
@@ -1,3 +1,152 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from PIL import Image
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from discussions.models import Category, Topic, Post
+from .models import Profile
+from .tasks import make_avatar_thumbnails
+from .views import UserActivityView
+
+
+class ProfilePostsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='1X<ISRUkw+tuK')
+        self.topic = Topic.objects.create(topic_title="Topic", category=Category.objects.create(category_name="Category"))
+
+    def get_profile(self):
+        return Profile.objects.get(user=self.user)
+
+    def test_post_count_and_last_post_at_follow_posts(self):
+        posts = [Post.objects.create(topic=self.topic, post_body=f"Post {i}", author=self.user) for i in range(3)]
+        profile = self.get_profile()
+        self.assertEqual(profile.post_count, 3)
+        self.assertEqual(profile.last_post_at, posts[2].creation_date)
+
+        posts[2].delete()
+        profile = self.get_profile()
+        self.assertEqual(profile.post_count, 2)
+        self.assertEqual(profile.last_post_at, posts[1].creation_date)
+
+        posts[0].delete()
+        self.assertEqual(self.get_profile().last_post_at, posts[1].creation_date)
+
+    def test_posts_created_before_the_counters_can_be_deleted(self):
+        posts = [Post.objects.create(topic=self.topic, post_body=f"Post {i}", author=self.user) for i in range(2)]
+        # the counters of the existing profiles start at 0 after the upgrade
+        Profile.objects.update(post_count=0)
+
+        posts[0].delete()
+        self.topic.delete()
+        self.assertEqual(self.get_profile().post_count, 0)
+
+    def test_reconcile_profile_posts_command(self):
+        post = Post.objects.create(topic=self.topic, post_body="Post", author=self.user)
+        Profile.objects.update(post_count=0, last_post_at=None)
+
+        out = StringIO()
+        call_command('reconcile_profile_posts', batch_size=1, stdout=out)
+
+        profile = self.get_profile()
+        self.assertEqual((profile.post_count, profile.last_post_at), (1, post.creation_date))
+        self.assertIn("Fixed post counts of 1 profiles", out.getvalue())
+
+
+class UserActivityViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user', password='1X<ISRUkw+tuK')
+        category = Category.objects.create(category_name="Category")
+        topics = [Topic.objects.create(topic_title=f"Topic {i}", category=category) for i in range(3)]
+        for i in range(25):
+            Post.objects.create(topic=topics[i % 3], post_body=f"Post {i}", author=self.user)
+        self.url = reverse('profiles:user_forum_activity', kwargs={'pk': self.user.pk})
+
+    def test_activity_is_paginated_and_first_page_is_cached(self):
+        # user, posts with their topics
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        posts = response.context['user_posts_list']
+        self.assertEqual(len(posts), UserActivityView.paginate_by)
+        self.assertEqual(posts[0].post_body, "Post 24")
+        self.assertContains(response, "Topic 0")
+
+        # the first page comes from the cache
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context['user_posts_list']), UserActivityView.paginate_by)
+
+        response = self.client.get(self.url + '?' + response.context['page_obj'].next_querystring)
+        self.assertEqual(len(response.context['user_posts_list']), 5)
+
+    def test_cached_page_is_invalidated_when_user_posts(self):
+        self.client.get(self.url)
+        Post.objects.create(topic=Topic.objects.first(), post_body="New post", author=self.user)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['user_posts_list'][0].post_body, "New post")
+
+
+class AvatarThumbnailsTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username='user', password='1X<ISRUkw+tuK')
+        self.client.login(username='user', password='1X<ISRUkw+tuK')
+
+    def upload_avatar(self):
+        content = BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(content, 'PNG')
+        avatar = SimpleUploadedFile('avatar.png', content.getvalue(), content_type='image/png')
+        self.client.post(reverse('profiles:edit_profile'), {'user_location': 'City', 'user_avatar': avatar})
+        return Profile.objects.get(user=self.user)
+
+    def test_thumbnails_are_made_for_uploaded_avatar(self):
+        profile = self.upload_avatar()
+        # the thumbnails are made after the commit
+        self.assertEqual(profile.avatar_hash, '')
+        self.assertEqual(profile.small_avatar.png, profile.user_avatar.url)
+
+        make_avatar_thumbnails(profile.pk)
+        profile.refresh_from_db()
+        self.assertTrue(profile.avatar_hash)
+        self.assertEqual(profile.medium_avatar.png, f'/media/user/avatar-{profile.avatar_hash}-90x90.png')
+        self.assertTrue(profile.small_avatar.webp.endswith(f'avatar-{profile.avatar_hash}-70x60.webp'))
+
+        with Image.open(f'{self.media_root}/user/avatar-{profile.avatar_hash}-70x60.webp') as thumbnail:
+            self.assertEqual(thumbnail.size, (70, 60))
+
+    def test_new_avatar_replaces_thumbnails_in_posts(self):
+        topic = Topic.objects.create(topic_title="Topic", category=Category.objects.create(category_name="Category"))
+        Post.objects.create(topic=topic, post_body="Post", author=self.user)
+        make_avatar_thumbnails(self.upload_avatar().pk)
+        old_hash = Profile.objects.get(user=self.user).avatar_hash
+        url = reverse('discussions:topic', kwargs={'topic_id': topic.pk})
+        self.assertContains(self.client.get(url), f'avatar-{old_hash}-90x90.png')
+
+        content = BytesIO()
+        Image.new('RGB', (400, 300), 'blue').save(content, 'PNG')
+        self.client.post(reverse('profiles:edit_profile'), {
+            'user_location': 'City', 'user_avatar': SimpleUploadedFile('new.png', content.getvalue())})
+        profile = Profile.objects.get(user=self.user)
+        make_avatar_thumbnails(profile.pk)
+        profile.refresh_from_db()
+
+        response = self.client.get(url)
+        self.assertContains(response, f'avatar-{profile.avatar_hash}-90x90.png')
+        self.assertNotContains(response, f'avatar-{old_hash}')
+        self.assertEqual(sorted(name for name in os.listdir(f'{self.media_root}/user') if name.startswith('avatar-')),
+                         sorted(f'avatar-{profile.avatar_hash}-{size}.{extension}'
+                                for size in ('70x60', '90x90') for extension in ('png', 'webp')))
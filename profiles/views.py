@@ -4,15 +4,19 @@ from django.views.generic.base import View
 
 from django.contrib.auth.models import User
 from django.shortcuts import render, redirect
+from django.db import transaction
 
 from .forms import UserInfoForm, ProfileInfoForm
 from .models import Profile
+from .tasks import make_avatar_thumbnails
+from .cache import get_first_activity_page
 from core.views import CheckUserMixin
+from core.pagination import KeysetPaginator
 from discussions.models import Post
 
 
 class UserDetailView(generic.DetailView):
-    model = User
+    queryset = User.objects.select_related('profile')
     template_name = 'profiles/user_profile.html'
 
     def get_context_data(self, **kwargs):
@@ -20,24 +24,34 @@ class UserDetailView(generic.DetailView):
         if self.request.user.pk == int(self.kwargs['pk']):
             page_title = "My profile"
         else:
-            page_title = f"{User.objects.get(pk=int(self.kwargs['pk'])).username} - Profile"
+            page_title = f"{self.object.username} - Profile"
         context['page_title'] =  page_title
         return context
 
 
-class UserActivityView(generic.ListView):
+class UserActivityView(generic.TemplateView):
     template_name = 'profiles/user_forum_activity.html'
-    context_object_name = 'user_posts_list'
-
-    def get_queryset(self):
-        author = User.objects.get(pk=int(self.kwargs['pk']))
-        return Post.objects.filter(author=author).order_by("-creation_date")
+    paginate_by = 20
 
     def get_context_data(self, **kwargs):
         context = super(UserActivityView, self).get_context_data(**kwargs)
-        username = User.objects.get(pk=int(self.kwargs['pk'])).username
-        context['page_title'] = f"{username} - User's forum activity"
-        context['username'] = username
+        author = get_object_or_404(User.objects.only('pk', 'username'), pk=self.kwargs['pk'])
+
+        # topics' titles are loaded with a join, the pages are read along the (author, creation_date) index
+        posts = Post.objects.filter(author=author).select_related('topic')
+        paginator = KeysetPaginator(posts, ('-creation_date', '-pk'), self.paginate_by)
+        after, before = self.request.GET.get('after'), self.request.GET.get('before')
+        if after or before:
+            posts_page = paginator.page(after=after, before=before)
+        else:
+            # the first page is the most visited one, see cache.py
+            posts_page = get_first_activity_page(author.pk, paginator)
+        posts_page.set_querystrings(self.request.GET)
+
+        context['user_posts_list'] = posts_page.object_list
+        context['page_obj'] = posts_page
+        context['page_title'] = f"{author.username} - User's forum activity"
+        context['username'] = author.username
         return context
 
 
@@ -86,6 +100,13 @@ class UserPageEditView(CheckUserMixin, View):
 
             not_empty_fields_profile = [k for k, v in profile_form.cleaned_data.items() if v]
             profile_model_instance = profile_form.save(commit=False)
+            if 'user_avatar' in request.FILES:
+                # the new avatar is shown as it is until its thumbnails are made in the background
+                profile_model_instance.avatar_hash = ''
+                not_empty_fields_profile.append('avatar_hash')
             profile_model_instance.save(update_fields=not_empty_fields_profile)
 
+            if 'user_avatar' in request.FILES:
+                transaction.on_commit(lambda: make_avatar_thumbnails.delay(profile_model_instance.pk))
+
             return redirect('profiles:user_details', pk=request.user.pk)
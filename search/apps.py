@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def create_search_index(sender, using, **kwargs):
+    from .backends import get_search_backend
+    get_search_backend(using).setup()
+
+
+class SearchConfig(AppConfig):
+    name = 'search'
+
+    def ready(self):
+        from . import signals
+        post_migrate.connect(create_search_index, sender=self)
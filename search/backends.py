@@ -0,0 +1,237 @@
+import re
+
+from django.db import connections
+from django.core.exceptions import ImproperlyConfigured
+
+from discussions.models import Topic, Post
+
+INDEX_TABLE = 'search_index'
+
+# highlighted words in snippets are wrapped with these characters (from the Unicode private use area),
+# they are replaced with HTML tags after the snippet is escaped, see SearchResult
+HIGHLIGHT_START = '\ue000'
+HIGHLIGHT_STOP = '\ue001'
+
+TOPIC = 'topic'
+POST = 'post'
+
+
+def entry_id(kind, object_id):
+    """Topics and posts share the index, so each kind gets its own half of the id space"""
+    return object_id * 2 + (1 if kind == POST else 0)
+
+
+class BaseSearchBackend:
+    """
+    Full-text index of topic titles and post bodies.
+    Every entry holds its kind, the id of the topic/post, the topic and category ids and the indexed text.
+    Entries are written with INSERT ... SELECT from the forum tables, so indexing never needs
+    to load the models.
+    """
+    id_column = 'id'
+
+    def __init__(self, using='default'):
+        self.connection = connections[using]
+
+    def setup(self):
+        """Create the index table if it doesn't exist yet"""
+        raise NotImplementedError
+
+    def search(self, query, category_id=None, after=None, limit=20):
+        """
+        Return up to `limit` (entry id, rank, kind, object id, topic id, snippet) rows matching `query`,
+        ordered by rank. `after` is the (rank, entry id) of the last row of the previous page.
+        """
+        raise NotImplementedError
+
+    def index_topics(self, where, params):
+        """Add or update the entries of the topics (aliased as `t`) matching the `where` SQL condition"""
+        raise NotImplementedError
+
+    def index_posts(self, where, params):
+        """Add or update the entries of the posts (aliased as `p`) matching the `where` SQL condition"""
+        raise NotImplementedError
+
+    def index_topic(self, topic_id):
+        self.index_topics('t.id = %s', [topic_id])
+        # the topic could be moved to another category
+        self.execute(f'UPDATE {INDEX_TABLE} SET category_id = (SELECT category_id FROM {Topic._meta.db_table} '
+                     f'WHERE id = %s) WHERE topic_id = %s', [topic_id, topic_id])
+
+    def index_post(self, post_id):
+        self.index_posts('p.id = %s', [post_id])
+
+    def remove(self, kind, object_id):
+        self.execute(f'DELETE FROM {INDEX_TABLE} WHERE {self.id_column} = %s', [entry_id(kind, object_id)])
+
+    def clear(self):
+        self.execute(f'DELETE FROM {INDEX_TABLE}')
+
+    def remove_topic_entries(self, topic_id):
+        """Remove the topic and all its posts from the index"""
+        self.execute(f'DELETE FROM {INDEX_TABLE} WHERE topic_id = %s', [topic_id])
+
+    def execute(self, sql, params=()):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def fetchall(self, sql, params=()):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    @staticmethod
+    def keyset_condition(after):
+        """Condition (and its params) selecting the rows ranked after the (rank, entry id) pair"""
+        if after is None:
+            return '', []
+        return 'WHERE rank < %s OR (rank = %s AND id < %s)', [after[0], after[0], after[1]]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Stores a tsvector `document` column covered by a GIN index, so matching never scans the forum tables.
+    Topic titles get more weight than post bodies.
+    """
+    config = 'english'
+    headline_options = (f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, '
+                        f'MaxWords=35, MinWords=15, MaxFragments=2, FragmentDelimiter=" ... "')
+
+    def setup(self):
+        self.execute(f'''
+            CREATE TABLE IF NOT EXISTS {INDEX_TABLE} (
+                id bigint PRIMARY KEY,
+                kind varchar(5) NOT NULL,
+                object_id integer NOT NULL,
+                topic_id integer NOT NULL,
+                category_id integer NOT NULL,
+                content text NOT NULL,
+                document tsvector NOT NULL
+            )
+        ''')
+        self.execute(f'CREATE INDEX IF NOT EXISTS {INDEX_TABLE}_document ON {INDEX_TABLE} USING gin (document)')
+        self.execute(f'CREATE INDEX IF NOT EXISTS {INDEX_TABLE}_topic_id ON {INDEX_TABLE} (topic_id)')
+
+    def upsert(self, select_sql, params):
+        self.execute(f'''
+            INSERT INTO {INDEX_TABLE} (id, kind, object_id, topic_id, category_id, content, document)
+            {select_sql}
+            ON CONFLICT (id) DO UPDATE SET topic_id = EXCLUDED.topic_id, category_id = EXCLUDED.category_id,
+                                           content = EXCLUDED.content, document = EXCLUDED.document
+        ''', params)
+
+    def index_topics(self, where, params):
+        self.upsert(f'''
+            SELECT t.id * 2, %s, t.id, t.id, t.category_id, t.topic_title,
+                   setweight(to_tsvector(%s, t.topic_title), 'A')
+            FROM {Topic._meta.db_table} t WHERE {where}
+        ''', [TOPIC, self.config, *params])
+
+    def index_posts(self, where, params):
+        self.upsert(f'''
+            SELECT p.id * 2 + 1, %s, p.id, p.topic_id, t.category_id, p.post_body,
+                   setweight(to_tsvector(%s, p.post_body), 'B')
+            FROM {Post._meta.db_table} p JOIN {Topic._meta.db_table} t ON t.id = p.topic_id WHERE {where}
+        ''', [POST, self.config, *params])
+
+    def search(self, query, category_id=None, after=None, limit=20):
+        conditions = ['document @@ q']
+        params = [self.config, query]
+        if category_id is not None:
+            conditions.append('category_id = %s')
+            params.append(category_id)
+
+        keyset, keyset_params = self.keyset_condition(after)
+
+        # the headline is the most expensive part, so it's computed only for the rows of the page
+        return self.fetchall(f'''
+            SELECT id, rank, kind, object_id, topic_id, ts_headline(%s, content, q, %s)
+            FROM (
+                SELECT id, rank, kind, object_id, topic_id, content, q FROM (
+                    SELECT id, kind, object_id, topic_id, content, q, ts_rank(document, q)::float8 AS rank
+                    FROM {INDEX_TABLE}, websearch_to_tsquery(%s, %s) q
+                    WHERE {' AND '.join(conditions)}
+                ) matches
+                {keyset}
+                ORDER BY rank DESC, id DESC
+                LIMIT %s
+            ) page
+            ORDER BY rank DESC, id DESC
+        ''', [self.config, self.headline_options, *params, *keyset_params, limit])
+
+
+class SqliteSearchBackend(BaseSearchBackend):
+    """
+    FTS5 virtual table, used when the project runs on SQLite (e.g. for tests).
+    """
+    id_column = 'rowid'
+
+    def setup(self):
+        self.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX_TABLE} USING fts5(
+                content, kind UNINDEXED, object_id UNINDEXED, topic_id UNINDEXED, category_id UNINDEXED,
+                tokenize='porter unicode61'
+            )
+        ''')
+
+    def upsert(self, ids_sql, select_sql, params):
+        # FTS5 tables have no ON CONFLICT clause, so the old entries are removed first
+        self.execute(f'DELETE FROM {INDEX_TABLE} WHERE rowid IN ({ids_sql})', params)
+        self.execute(f'''
+            INSERT INTO {INDEX_TABLE} (rowid, kind, object_id, topic_id, category_id, content)
+            {select_sql}
+        ''', params)
+
+    def index_topics(self, where, params):
+        self.upsert(f'SELECT t.id * 2 FROM {Topic._meta.db_table} t WHERE {where}',
+                    f'''SELECT t.id * 2, '{TOPIC}', t.id, t.id, t.category_id, t.topic_title
+                        FROM {Topic._meta.db_table} t WHERE {where}''',
+                    params)
+
+    def index_posts(self, where, params):
+        self.upsert(f'SELECT p.id * 2 + 1 FROM {Post._meta.db_table} p WHERE {where}',
+                    f'''SELECT p.id * 2 + 1, '{POST}', p.id, p.topic_id, t.category_id, p.post_body
+                        FROM {Post._meta.db_table} p JOIN {Topic._meta.db_table} t ON t.id = p.topic_id
+                        WHERE {where}''',
+                    params)
+
+    def search(self, query, category_id=None, after=None, limit=20):
+        # every word is quoted, so users can't inject the FTS5 query syntax
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+
+        conditions = [f'{INDEX_TABLE} MATCH %s']
+        params = [' '.join(f'"{word}"' for word in words)]
+        if category_id is not None:
+            conditions.append('category_id = %s')
+            params.append(category_id)
+
+        keyset, keyset_params = self.keyset_condition(after)
+
+        # bm25() is lower for better matches
+        return self.fetchall(f'''
+            SELECT id, rank, kind, object_id, topic_id, snippet_text FROM (
+                SELECT rowid AS id, -bm25({INDEX_TABLE}) AS rank, kind, object_id, topic_id,
+                       snippet({INDEX_TABLE}, 0, %s, %s, ' ... ', 35) AS snippet_text
+                FROM {INDEX_TABLE}
+                WHERE {' AND '.join(conditions)}
+            )
+            {keyset}
+            ORDER BY rank DESC, id DESC
+            LIMIT %s
+        ''', [HIGHLIGHT_START, HIGHLIGHT_STOP, *params, *keyset_params, limit])
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+    vendor = connections[using].vendor
+    try:
+        return BACKENDS[vendor](using)
+    except KeyError:
+        raise ImproperlyConfigured(f"Full-text search is not supported by the '{vendor}' database")
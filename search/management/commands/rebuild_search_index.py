@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from discussions.models import Topic, Post
+from search.backends import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Add all topics and posts to the full-text search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Amount of rows indexed per statement")
+        parser.add_argument('--clear', action='store_true', help="Remove all entries from the index first")
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.setup()
+        if options['clear']:
+            backend.clear()
+
+        batch_size = options['batch_size']
+        for model, index in ((Topic, backend.index_topics), (Post, backend.index_posts)):
+            alias = 't' if model is Topic else 'p'
+            last_pk = model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+            # every chunk is a single INSERT ... SELECT over a range of primary keys
+            for start in range(0, last_pk, batch_size):
+                with transaction.atomic():
+                    index(f'{alias}.id > %s AND {alias}.id <= %s', [start, start + batch_size])
+
+            self.stdout.write(f"Indexed {model._meta.verbose_name_plural} up to id {last_pk}")
+
+        self.stdout.write(self.style.SUCCESS("The search index is rebuilt"))
@@ -0,0 +1,3 @@
+from django.db import models
+
+# The search index table is vendor specific, it is created by the search backend, see apps.py and backends.py
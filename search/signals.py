@@ -0,0 +1,27 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from discussions.models import Topic, Post
+from .backends import get_search_backend, POST
+
+
+# keep the search index up to date when topics/posts are added, changed or deleted
+# the entries are written in the same transaction as the topics/posts
+@receiver(post_save, sender=Topic)
+def index_topic(sender, instance, using, **kwargs):
+    get_search_backend(using).index_topic(instance.pk)
+
+
+@receiver(post_delete, sender=Topic)
+def remove_topic_from_index(sender, instance, using, **kwargs):
+    get_search_backend(using).remove_topic_entries(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, using, **kwargs):
+    get_search_backend(using).index_post(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_from_index(sender, instance, using, **kwargs):
+    get_search_backend(using).remove(POST, instance.pk)
@@ -0,0 +1,91 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from django.contrib.auth.models import User
+from discussions.models import Category, Topic, Post
+from core.pagination import encode_cursor
+from .backends import get_search_backend
+from .views import SearchView
+
+
+class SearchViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testuser', password='1X<ISRUkw+tuK')
+        cls.category1 = Category.objects.create(category_name="Category 1")
+        cls.category2 = Category.objects.create(category_name="Category 2")
+        cls.topic1 = Topic.objects.create(topic_title="Growing tomatoes", category=cls.category1,
+                                          last_active_user=test_user)
+        cls.topic2 = Topic.objects.create(topic_title="Bicycles", category=cls.category2, last_active_user=test_user)
+        cls.post1 = Post.objects.create(topic=cls.topic1, post_body="Tomatoes need a lot of sun", author=test_user)
+        cls.post2 = Post.objects.create(topic=cls.topic2, post_body="I carry tomatoes & apples on my bicycle",
+                                        author=test_user)
+
+    def search(self, **params):
+        response = self.client.get(reverse('search:search'), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_search_view_without_query(self):
+        response = self.search()
+        self.assertTemplateUsed(response, 'search/search.html')
+        self.assertIsNone(response.context['page_obj'])
+
+    def test_search_view_finds_topics_and_posts_ranked(self):
+        results = list(self.search(q="tomatoes").context['page_obj'])
+        self.assertEqual(len(results), 3)
+        # the topic title weights more than post bodies
+        self.assertEqual(results[0].kind, 'topic')
+        self.assertEqual(results[0].topic, self.topic1)
+        self.assertEqual({result.post for result in results[1:]}, {self.post1, self.post2})
+
+    def test_search_view_highlights_escaped_snippets(self):
+        result = self.search(q="bicycle").context['page_obj'][-1]
+        self.assertEqual(result.post, self.post2)
+        self.assertIn("<mark>bicycle</mark>", result.snippet)
+        self.assertIn("&amp;", result.snippet)
+
+    def test_search_view_filters_by_category(self):
+        results = list(self.search(q="tomatoes", category=self.category2.pk).context['page_obj'])
+        self.assertEqual([result.post for result in results], [self.post2])
+
+    def test_search_view_pagination(self):
+        topic = Topic.objects.get(topic_title="Bicycles")
+        for i in range(SearchView.paginate_by + 3):
+            Post.objects.create(topic=topic, post_body=f"Spare wheel #{i}", author=topic.last_active_user)
+
+        page = self.search(q="wheel").context['page_obj']
+        self.assertTrue(page.has_next())
+        next_page = self.search(q="wheel", after=page.next_cursor).context['page_obj']
+        self.assertFalse(next_page.has_next())
+
+        found = [result.post.pk for result in page] + [result.post.pk for result in next_page]
+        self.assertEqual(len(found), SearchView.paginate_by + 3)
+        self.assertEqual(len(set(found)), len(found))
+
+    def test_search_view_invalid_cursor(self):
+        for values in (["rank", 1], [0.5, {"id": 1}], [0.5, "1.5"], [None, 1]):
+            response = self.client.get(reverse('search:search'), {'q': "tomatoes", 'after': encode_cursor(values)})
+            self.assertEqual(response.status_code, 404)
+
+    def test_search_index_follows_posts_changes(self):
+        post = Post.objects.get(pk=self.post1.pk)
+        post.post_body = "Cucumbers"
+        post.save()
+        self.assertEqual([result.post for result in self.search(q="cucumbers").context['page_obj']], [post])
+
+        post.delete()
+        self.assertFalse(self.search(q="cucumbers").context['page_obj'])
+
+        Topic.objects.get(pk=self.topic2.pk).delete()
+        self.assertEqual([result.topic for result in self.search(q="tomatoes").context['page_obj']], [self.topic1])
+
+    def test_rebuild_search_index_command(self):
+        get_search_backend().clear()
+        self.assertFalse(self.search(q="tomatoes").context['page_obj'])
+
+        call_command('rebuild_search_index', batch_size=1, stdout=StringIO())
+        self.assertEqual(len(self.search(q="tomatoes").context['page_obj']), 3)
@@ -0,0 +1,77 @@
+from django.http import Http404
+from django.shortcuts import render
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.views.generic.base import View
+
+from core.pagination import KeysetPage, encode_cursor, decode_cursor
+from discussions.models import Topic, Post
+from discussions.cache import get_categories
+from .backends import get_search_backend, HIGHLIGHT_START, HIGHLIGHT_STOP, TOPIC
+
+
+class SearchResult:
+    def __init__(self, kind, topic, post, snippet):
+        self.kind = kind
+        self.topic = topic
+        self.post = post
+        # the snippet is the raw indexed text, only the highlighting markers become HTML
+        self.snippet = mark_safe(escape(snippet).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>'))
+
+
+class SearchView(View):
+    paginate_by = 20
+
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        category_id = self.get_category_id()
+        page = None
+
+        if query:
+            page = self.search(query, category_id)
+
+        return render(request, 'search/search.html', {
+            'query': query,
+            'category_id': category_id,
+            'categories_list': get_categories(),
+            'page_obj': page,
+            'page_title': f"{query} - Search" if query else "Search",
+        })
+
+    def get_category_id(self):
+        try:
+            return int(self.request.GET['category'])
+        except (KeyError, ValueError):
+            return None
+
+    def search(self, query, category_id):
+        after = None
+        if self.request.GET.get('after'):
+            after = decode_cursor(self.request.GET['after'])
+            if len(after) != 2:
+                raise Http404("Invalid page cursor")
+            # the values go into the raw SQL comparison with the rank and the entry id
+            try:
+                after = [float(after[0]), int(after[1])]
+            except (TypeError, ValueError):
+                raise Http404("Invalid page cursor")
+
+        rows = get_search_backend().search(query, category_id=category_id, after=after, limit=self.paginate_by + 1)
+        has_more = len(rows) > self.paginate_by
+        rows = rows[:self.paginate_by]
+
+        # the matched topics and posts of the whole page are loaded with two queries
+        topics = Topic.objects.in_bulk({topic_id for _, _, _, _, topic_id, _ in rows})
+        posts = Post.objects.select_related('author').in_bulk(
+            {object_id for _, _, kind, object_id, _, _ in rows if kind != TOPIC})
+
+        results = []
+        for entry_id, rank, kind, object_id, topic_id, snippet in rows:
+            post = posts.get(object_id) if kind != TOPIC else None
+            if topic_id in topics and (kind == TOPIC or post is not None):
+                results.append(SearchResult(kind, topics[topic_id], post, snippet))
+
+        next_cursor = encode_cursor([rows[-1][1], rows[-1][0]]) if has_more else None
+        page = KeysetPage(results, next_cursor=next_cursor)
+        page.set_querystrings(self.request.GET)
+        return page